@@ -16,6 +16,38 @@ from PyQt5.QtWidgets import QMessageBox
 qtCreator_file = "engima_gui.ui"
 Ui_MainWindow, QtBaseClass = uic.loadUiType(qtCreator_file)
 
+class Encode_worker(QtCore.QObject):
+    """Encodes text on a background thread, emitting the output in chunks"""
+
+    chunk = QtCore.pyqtSignal(str)
+    progress = QtCore.pyqtSignal(int)
+    finished = QtCore.pyqtSignal(bool)
+
+    # Letters per chunk: large enough to keep signal overhead low, small enough that
+    # progress and cancellation are seen several times a second
+    chunk_size = 1 << 16
+
+    def __init__(self, machine, text):
+        super().__init__()
+        self._machine = machine
+        self._text = text
+        self._cancelled = False
+
+    def cancel(self):
+        """Stops encoding after the current chunk; called from the GUI thread"""
+
+        self._cancelled = True
+
+    def run(self):
+        # The text was checked once in the GUI thread, so the chunks are encoded unchecked
+        for start in range(0, len(self._text), self.chunk_size):
+            if self._cancelled:
+                break
+            stop = min(start + self.chunk_size, len(self._text))
+            self.chunk.emit(self._machine.encode(self._text[start:stop], trusted = True))
+            self.progress.emit(100 * stop // len(self._text))
+        self.finished.emit(self._cancelled == False)
+
 class MyWindow(QtWidgets.QMainWindow, Ui_MainWindow):
     def __init__(self):
         super().__init__()
@@ -38,6 +70,18 @@ class MyWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         # Encode button press
         self.encodebutton.clicked.connect(self.engima_run)
 
+        # Background encoding, with its progress shown in the status bar
+        self._thread = None
+        self._worker = None
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.hide()
+        self.statusbar.addPermanentWidget(self.progress_bar)
+
+        # Compiled machine of the last run and the settings it was built from
+        self._machine = None
+        self._last_settings = None
+
     def rotor4_on_off(self):
         if self.radiobutt4.isChecked() == True:
             self.cb4.setEnabled(True)
@@ -66,7 +110,80 @@ class MyWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.input_box.setText("")
         self.output_box.clear()
 
+    def _settings(self):
+        """Returns the current settings of the window, used to decide if the machine of the
+        last run can be reused"""
+
+        return (self.radiobutt4.isChecked(), self.ref_input.currentText(), self.Pb_input.text(),
+                [(cb.currentText(), startpos.currentText(), ringpos.text()) for cb, startpos, ringpos
+                 in ((self.cb4, self.startpos4, self.ringpos4), (self.cb3, self.startpos3, self.ringpos3),
+                     (self.cb2, self.startpos2, self.ringpos2), (self.cb1, self.startpos1, self.ringpos1))])
+
     def engima_run(self):
+
+        # Pressed again while encoding: cancel
+        if self._worker != None:
+            self._worker.cancel()
+            return
+
+        # Get text to encode (remove lines and spaces), checked in one pass
+        text = "".join(self.input_box.toPlainText().split())
+        if text == "":
+            self.output_box.clear()
+            return
+        if text.isascii() == False or text.isalpha() == False:
+            self.input_error_popup()
+            return
+
+        # Same settings as the last run: move its rotors back to the start instead of rebuilding
+        settings = self._settings()
+        if settings == self._last_settings:
+            E = self._machine
+            E.reset()
+        else:
+            E = self._build_machine().compile()
+            self._machine = E
+            self._last_settings = settings
+
+        # Encode on a worker thread; output is appended as each chunk arrives
+        self.output_box.clear()
+        self._thread = QtCore.QThread()
+        self._worker = Encode_worker(E, text.upper())
+        self._worker.moveToThread(self._thread)
+        self._thread.started.connect(self._worker.run)
+        self._worker.chunk.connect(self._append_output)
+        self._worker.progress.connect(self.progress_bar.setValue)
+        self._worker.finished.connect(self._encode_finished)
+
+        self.encodebutton.setText("Cancel")
+        self.progress_bar.setValue(0)
+        self.progress_bar.show()
+        self.statusbar.showMessage(f"Encoding {len(text)} letters")
+        self._thread.start()
+
+    def _append_output(self, chunk):
+        self.output_box.moveCursor(QtGui.QTextCursor.End)
+        self.output_box.insertPlainText(chunk)
+
+    def _encode_finished(self, completed):
+        self._thread.quit()
+        self._thread.wait()
+        self._thread = None
+        self._worker = None
+
+        self.encodebutton.setText("Encode")
+        self.progress_bar.hide()
+        self.statusbar.showMessage("Encoding finished" if completed else "Encoding cancelled", 5000)
+
+    def closeEvent(self, event):
+        # Let a running worker stop before its thread is destroyed
+        if self._worker != None:
+            self._worker.cancel()
+            self._thread.quit()
+            self._thread.wait()
+        super().closeEvent(event)
+
+    def _build_machine(self):
         
         # Setup rotors
         r4 = Rotor(self.cb4.currentText(), 
@@ -108,17 +225,7 @@ class MyWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         reflector = Reflector(self.ref_input.currentText())
 
         # Build machine
-        E = Enigma_machine(rotor, reflector, pb)
-
-        # Get result from encoding (remove lines and spaces)
-        text = self.input_box.toPlainText()
-        text = text.replace("\n","")
-        text = text.replace(" ", "")
-        for letter in text:
-            if letter.upper() not in "ABCDEFGHIJKLMNOPQRSTUVWXYZ":
-                self.input_error_popup()
-        out_text = E.encode(text)
-        self.output_box.setText(str(out_text))
+        return Enigma_machine(rotor, reflector, pb)
 
     def plugboard_error_popup(self, error_type):
         msg = QMessageBox()
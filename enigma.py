@@ -1,6 +1,11 @@
 
 from abc import ABC
 from abc import abstractmethod
+from collections import OrderedDict
+import re
+import threading
+import time
+from types import MappingProxyType
 
 ### Detailed information on the functionality of the engima machine, and the 
 ### classes below are contained in the readme.md file.  
@@ -8,6 +13,8 @@ from abc import abstractmethod
 
 class plugs(ABC):
     """Abstract base class used for creation of PlugLead and Plugboard classes"""
+
+    __slots__ = ()
     
     @abstractmethod
     def _input_check(self, user_input, length):
@@ -43,10 +50,16 @@ class plugs(ABC):
         
 class PlugLead(plugs):
     """Creates PlugLead objects which have functionality of Plugleads"""
+
+    __slots__ = ("_lead",)
     
     def __init__(self, lead):
         self._input_check(lead, 2)
-        self.plug_dict = {lead[0]:lead[1], lead[1]:lead[0]}
+        self._lead = lead
+
+    @property
+    def plug_dict(self):
+        return {self._lead[0]:self._lead[1], self._lead[1]:self._lead[0]}
     
     def _input_check(self, user_input, length):
         super()._input_check(user_input, length)
@@ -63,39 +76,187 @@ class PlugLead(plugs):
                  
 class Plugboard(plugs):
     """Creates Plugboard objects which have functionality of Plugboards"""
+
+    __slots__ = ("_perm", "_plugged_count", "_history", "_committed", "_table")
+
+    _alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
     
     def __init__(self):
-        self.plug_dict = {}
+        # Permutation of the letter codes 0-25; connected letters map to each other
+        self._perm = bytearray(range(26))
+        self._plugged_count = 0
+
+        # One list of (code, previous partner) per change since the last commit, for undo,
+        # and the number of changes committed before them
+        self._history = []
+        self._committed = 0
+
+        # bytes.translate table of the permutation, rebuilt when needed after a change
+        self._table = None
+
+    @property
+    def plug_dict(self):
+        """Dictionary of every connected letter to its partner"""
+
+        alphabet = Plugboard._alphabet
+        return {alphabet[code]: alphabet[other] for code, other in enumerate(self._perm)
+                if code != other}
+
+    @property
+    def permutation(self):
+        """The plugboard as a read-only sequence of 26 codes (e.g. for the solver's tables)"""
+
+        return bytes(self._perm)
         
     def __getitem__(self, letter):
-        return super().encode(letter)
+        return self.encode(letter)
     
     def __contains__(self, letter):
-        return super().__contains__(letter)
+        self._input_check(letter, 1)
+        code = ord(letter) - 65
+        return self._perm[code] != code
  
     def _input_check(self, user_input, length):
         super()._input_check(user_input, length)
         
     def encode(self, letter):
-        return super().encode(letter)
-    
+        self._input_check(letter, 1)
+        return chr(self._perm[ord(letter) - 65] + 65)
+
+    def translate(self, text):
+        """Passes every letter A-Z of a string through the plugboard at once; other
+        characters are left as they are"""
+
+        if self._table == None:
+            self._table = bytes(range(65)) + bytes(code + 65 for code in self._perm) + bytes(range(91, 256))
+        if text.isascii():
+            return text.encode("ascii").translate(self._table).decode("ascii")
+        return text.translate(dict(zip(range(256), self._table.decode("latin-1"))))
+
+    @staticmethod
+    def _code(letter):
+        """Letter A-Z or code 0-25 as a code"""
+
+        if isinstance(letter, int):
+            if letter < 0 or letter > 25:
+                raise ValueError("Integer 0-25")
+            return letter
+        if isinstance(letter, str) == False or len(letter) != 1 or letter.isupper() == False or letter.isascii() == False:
+            raise ValueError("Uppercase letters only")
+        return ord(letter) - 65
+
+    def _set(self, change, code, other):
+        old = self._perm[code]
+        change.append((code, old))
+        self._perm[code] = other
+        self._plugged_count += (other != code) - (old != code)
+
+    def _disconnect(self, change, code):
+        other = self._perm[code]
+        if other != code:
+            self._set(change, code, code)
+            self._set(change, other, other)
+
+    def swap(self, a, b):
+        """Connects two letters (A-Z or codes 0-25), first removing any leads on either"""
+
+        a, b = self._code(a), self._code(b)
+        if a == b:
+            raise ValueError("Letters must not be identical")
+        if self._perm[a] != b:
+            change = []
+            self._disconnect(change, a)
+            self._disconnect(change, b)
+            self._set(change, a, b)
+            self._set(change, b, a)
+            self._history.append(change)
+            self._table = None
+
+    def unswap(self, letter):
+        """Removes the lead on a letter, if there is one"""
+
+        change = []
+        self._disconnect(change, self._code(letter))
+        if change:
+            self._history.append(change)
+            self._table = None
+
+    def partner(self, letter):
+        """Returns the code a letter (A-Z or code 0-25) is connected to (its own if none)"""
+
+        return self._perm[self._code(letter)]
+
+    def checkpoint(self):
+        """Returns a token for undo: the changes made after it can be reverted"""
+
+        # Changes are counted across commits, so a checkpoint taken before a commit is
+        # recognised as stale instead of reverting later changes
+        return self._committed + len(self._history)
+
+    def undo(self, checkpoint = None):
+        """Reverts the last change (swap, unswap or add), or every change after a checkpoint"""
+
+        if checkpoint == None:
+            if len(self._history) == 0:
+                raise ValueError("Nothing to undo")
+            checkpoint = self._committed + len(self._history) - 1
+        if checkpoint < self._committed:
+            raise ValueError("Checkpoint was taken before the last commit")
+        checkpoint -= self._committed
+        if checkpoint > len(self._history):
+            raise ValueError("Checkpoint is not in the history")
+        while len(self._history) > checkpoint:
+            for code, other in reversed(self._history.pop()):
+                self._plugged_count += (other != code) - (self._perm[code] != code)
+                self._perm[code] = other
+        self._table = None
+
+    def commit(self):
+        """Forgets the undo history; the current leads are kept. Checkpoints taken before
+        are no longer valid."""
+
+        self._committed += len(self._history)
+        self._history.clear()
+
+    def leads(self):
+        """Returns the leads as a sorted list of letter pairs, e.g. ['AB', 'CX']"""
+
+        alphabet = Plugboard._alphabet
+        return [alphabet[code] + alphabet[other] for code, other in enumerate(self._perm) if code < other]
+
+    def diff(self, other):
+        """Returns (added, removed): the leads to add to and remove from other to make it
+        the same as this plugboard"""
+
+        mine, theirs = set(self.leads()), set(other.leads())
+        return sorted(mine - theirs), sorted(theirs - mine)
+
+    def copy(self):
+        """Returns a new Plugboard with the same leads and no undo history"""
+
+        plugboard = Plugboard()
+        plugboard._perm[:] = self._perm
+        plugboard._plugged_count = self._plugged_count
+        return plugboard
+
+    def _plugged(self):
+        """Returns the number of letters with a lead"""
+
+        return self._plugged_count
+
     def add(self, plug):
         """Checks and removes if Plug occupied before adding new PlugLead"""
 
-        if isinstance(plug, PlugLead) and len(self.plug_dict.keys()) <= 20:
-            for key in plug.plug_dict.keys():
-                if key in self:
-                    self._remove(self[key]) 
-                    self._remove(key)
-            self.plug_dict.update(plug.plug_dict)
+        if isinstance(plug, PlugLead) and self._plugged() <= 20:
+            self.swap(*plug._lead)
         
     def _remove(self, letter):
-        self.plug_dict.pop(letter)
+        self.unswap(letter)
         
     def multiple_adds(self, *args):
         """Creates and adds multiple PlugLeads from a number of letter pairs"""
 
-        if len(args)*2 + len(self.plug_dict.keys()) <= 20:
+        if len(args)*2 + self._plugged() <= 20:
             for arg in args:
                 if isinstance(arg, PlugLead):
                     self.add(arg)
@@ -104,44 +265,183 @@ class Plugboard(plugs):
         else:
             raise ValueError("Plugboard Full")
 
+class Wheel():
+    """Creates Wheel object, the read-only definition of a rotor or reflector wiring"""
+
+    __slots__ = ("name", "mapping", "notch", "forward", "inverse")
+
+    _alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+    def __init__(self, name, mapping, notch = [None]):
+        if isinstance(mapping, str) == False or len(mapping) != 26 or set(mapping) != set(Wheel._alphabet):
+            raise ValueError("mapping must be all A-Z")
+        if list(notch) != [None]:
+            for _notch in notch:
+                if isinstance(_notch, str) == False or _notch.isalpha() != True or len(_notch) != 1:
+                    raise ValueError("Notch must be letter A-Z or None")
+
+        # Wirings as bytes of the integers 0-25, right-to-left (forward) and left-to-right
+        forward = bytes(ord(letter) - 65 for letter in mapping)
+        inverse = bytes(forward.index(idx) for idx in range(26))
+        for attr, value in (("name", name), ("mapping", mapping), ("notch", tuple(notch)),
+                            ("forward", forward), ("inverse", inverse)):
+            object.__setattr__(self, attr, value)
+
+    def __setattr__(self, attr, value):
+        raise AttributeError("Wheel definitions are read-only")
+
+    def __delattr__(self, attr):
+        raise AttributeError("Wheel definitions are read-only")
+
+    def __reduce__(self):
+        return (Wheel, (self.name, self.mapping, list(self.notch)))
+
+    def __eq__(self, other):
+        return (isinstance(other, Wheel) and (self.name, self.mapping, self.notch)
+                == (other.name, other.mapping, other.notch))
+
+    def __hash__(self):
+        return hash((self.name, self.mapping, self.notch))
+
+    def __repr__(self):
+        return f"Wheel({self.name!r}, {self.mapping!r}, notch = {list(self.notch)})"
+
+class Wiring_registry():
+    """Creates Wiring_registry object, a catalogue of rotor and reflector Wheels.
+
+    A frozen registry can not be changed, so it is safe to share between threads and
+    processes. session() returns a registry of its own layered on top, which takes custom
+    wheels and falls back on this one for every other name.
+    """
+
+    __slots__ = ("_rotors", "_reflectors", "_parent", "_frozen", "_lock")
+
+    def __init__(self, rotors = (), reflectors = (), parent = None, frozen = False):
+        self._rotors = {}
+        self._reflectors = {}
+        self._parent = parent
+        self._frozen = False
+        self._lock = threading.Lock()
+        for wheel in rotors:
+            self.add_rotor(wheel)
+        for wheel in reflectors:
+            self.add_reflector(wheel)
+        self._frozen = frozen
+
+    @classmethod
+    def from_dicts(cls, rot_dict, notch_dict, reflectors, frozen = True):
+        """Builds a registry from dictionaries of names to mappings (and notches)"""
+
+        return cls([Wheel(name, mapping, notch_dict.get(name, [None]))
+                    for name, mapping in rot_dict.items()],
+                   [Wheel(name, mapping) for name, mapping in reflectors.items()],
+                   frozen = frozen)
+
+    def session(self):
+        """Returns an empty registry for custom wheels, layered on top of this one"""
+
+        return Wiring_registry(parent = self)
+
+    def _find(self, table, name):
+        registry = self
+        while registry != None:
+            wheel = getattr(registry, table).get(name)
+            if wheel != None:
+                return wheel
+            registry = registry._parent
+        return None
+
+    def _add(self, table, wheel):
+        if isinstance(wheel, Wheel) == False:
+            raise TypeError("Wheel instances only")
+        if self._frozen:
+            raise TypeError("Registry is read-only, add custom wheels to a session()")
+        with self._lock:
+            existing = self._find(table, wheel.name)
+            if existing != None and existing != wheel:
+                raise ValueError(f"{wheel.name} is already defined with a different wiring")
+            getattr(self, table)[wheel.name] = wheel
+
+    def add_rotor(self, wheel):
+        self._add("_rotors", wheel)
+
+    def add_reflector(self, wheel):
+        self._add("_reflectors", wheel)
+
+    def rotor(self, name):
+        """Returns the Wheel of a rotor; KeyError if the name is unknown"""
+
+        wheel = self._find("_rotors", name)
+        if wheel == None:
+            raise KeyError(name)
+        return wheel
+
+    def reflector(self, name):
+        """Returns the Wheel of a reflector; KeyError if the name is unknown"""
+
+        wheel = self._find("_reflectors", name)
+        if wheel == None:
+            raise KeyError(name)
+        return wheel
+
+    def _names(self, table):
+        names = [] if self._parent == None else self._parent._names(table)
+        return names + [name for name in getattr(self, table) if name not in names]
+
+    def rotor_names(self):
+        return self._names("_rotors")
+
+    def reflector_names(self):
+        return self._names("_reflectors")
+
+    def __str__(self):
+        return (f"Wiring_registry: rotors {self.rotor_names()}, " +
+                f"reflectors {self.reflector_names()}")
+
 class Rotor():
     """Creates Rotor object with all the functionality of a Rotor"""
+
+    __slots__ = ("_rotor_name", "_start_pos", "_ring_pos", "_notch", "_pawl", "_offset",
+                 "_wiring", "_inverse", "_adjusted_notch")
     
     _alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-    _notch_dict = {"I" : ["Q"], "II" : ["E"], "III" : ["V"], "IV" : ["J"], "V" : ["Z"]} #HERE  
-    _rot_dict = {"I" : "EKMFLGDQVZNTOWYHXUSPAIBRCJ",
+    _notch_dict = MappingProxyType({"I" : ("Q",), "II" : ("E",), "III" : ("V",), "IV" : ("J",),
+                                    "V" : ("Z",)}) #HERE
+    _rot_dict = MappingProxyType({"I" : "EKMFLGDQVZNTOWYHXUSPAIBRCJ",
                 "II" : "AJDKSIRUXBLHWTMCQGZNPYFVOE",
                 "III" : "BDFHJLCPRTXVZNYEIWGAKMUSQO",
                 "IV" : "ESOVPZJAYQUIRHXLNFTGKDCMWB",
                 "V" : "VZBRGITYUPSDNHLXAWMJQOFECK",
                 "Beta" : "LEYJVCNIXWPBQMDRTAKZGFUHOS",
-                "Gamma" : "FSOKANUERHMBTIYCWLQPZXVGJD"}
-    _reflectors = {"A": "EJMZALYXVBWFCRQUONTSPIKHGD",
+                "Gamma" : "FSOKANUERHMBTIYCWLQPZXVGJD"})
+    _reflectors = MappingProxyType({"A": "EJMZALYXVBWFCRQUONTSPIKHGD",
                  "B": "YRUHQSLDPXNGOKMIEBFZCWVJAT",
-                 "C": "FVPJIAOYEDRZXWGCTKUQSBNMHL"}
+                 "C": "FVPJIAOYEDRZXWGCTKUQSBNMHL"})
+
+    # The built in wheels. Frozen, and shared by every rotor that does not name a registry
+    _registry = Wiring_registry.from_dicts(_rot_dict, _notch_dict, _reflectors)
     
-    def __init__(self, rot_name, start_pos = "A", ring_pos = 1, pawl = True):
+    def __init__(self, rot_name, start_pos = "A", ring_pos = 1, pawl = True, registry = None):
         self._rotor_check_str(start_pos)
         self._rotor_check_int(ring_pos)
+        wheel = (Rotor._registry if registry == None else registry).rotor(rot_name)
         
         self._rotor_name = rot_name
         self._start_pos = start_pos
         self._ring_pos = ring_pos
-        self._notch = Rotor._notch_dict.get(rot_name, [None])
+        self._notch = list(wheel.notch)
         self._pawl = pawl
         
-        # Create rotor variable, which is a list letters A-Z, adjusted for positioning
-        self._rotor = [Rotor._alphabet[(i + ord(self._start_pos) - 64 - self._ring_pos) % 26]
-         for i in range(26)]
+        # Position of the rotor, as an offset into the alphabet adjusted for ring position
+        self._offset = (ord(self._start_pos) - 64 - self._ring_pos) % 26
         
-        # Create dictionaries which represent the internal wiring within a rotor
-        self._mapping_rl = dict(zip(Rotor._alphabet, Rotor._rot_dict[rot_name]))
-        self._mapping_lr = dict(zip(Rotor._rot_dict[rot_name], Rotor._alphabet))
+        # Internal wiring within a rotor, shared with the Wheel
+        self._wiring, self._inverse = wheel.forward, wheel.inverse
         
         # Adjust the list containing notch / notches for ring position.
         self._adjusted_notch = []
         if self._notch != [None]: ##HERE
-            for i in Rotor._notch_dict[self._rotor_name]:
+            for i in wheel.notch:
                 self._adjusted_notch.append(Rotor._alphabet[25-(-self._alphabet.find(i)
                                                  + self._ring_pos - 2)%26])
         else:
@@ -156,76 +456,138 @@ class Rotor():
             raise ValueError("Letter A-Z")
 
     def rotate(self):
-        """'Rotates a rotor by taking letter and index 0 and moving it to end"""
+        """'Rotates a rotor by moving its offset on by one letter"""
+
+        self._offset = (self._offset + 1) % 26
+
+    def reset(self):
+        """Moves the rotor back to its start position"""
+
+        self._offset = (ord(self._start_pos) - 64 - self._ring_pos) % 26
+
+    @property
+    def offset(self):
+        """Integer 0-25; the current position of the rotor, i.e. the index of _rotor[0]"""
+
+        return self._offset
+
+    @offset.setter
+    def offset(self, offset):
+        self._offset = offset % 26
 
-        self._rotor.append(self._rotor.pop(0))    
+    @property
+    def _rotor(self):
+        """List of the letters A-Z, starting from the current position"""
+
+        return [Rotor._alphabet[(i + self._offset) % 26] for i in range(26)]
+
+    @property
+    def _mapping_rl(self):
+        return dict(zip(Rotor._alphabet, (Rotor._alphabet[idx] for idx in self._wiring)))
+
+    @property
+    def _mapping_lr(self):
+        return dict(zip(Rotor._alphabet, (Rotor._alphabet[idx] for idx in self._inverse)))
+
+    def _engaged(self):
+        """Returns True if the rotor is on a notch and has a pawl on its left"""
+
+        return self._pawl == True and Rotor._alphabet[self._offset] in self._adjusted_notch
+
+    def _engage_table(self):
+        """Returns 26 booleans, True where the rotor is on a notch and has a pawl on its left"""
+
+        return tuple(self._pawl == True and Rotor._alphabet[offset] in self._adjusted_notch
+                     for offset in range(26))
     
     def _encode_right_to_left(self, index_in):
         """Encodes a letter in right to left manner by checking entrance index and mapping"""
 
         self._rotor_check_int(index_in)
-        connector = self._rotor[index_in - 1]
-        pin = self._mapping_rl[connector]
-        difference = ord(pin) - ord(connector)
-        return 26 - (- index_in - difference ) % 26
+        return (self._wiring[(index_in - 1 + self._offset) % 26] - self._offset) % 26 + 1
  
     def _encode_left_to_right(self, index_in):
         """Encodes a letter in left to right manner by checking entrance index and mapping"""
 
         self._rotor_check_int(index_in)
-        connector = self._rotor[index_in - 1]
-        pin = self._mapping_lr[connector]
-        difference = ord(pin) - ord(connector)
-        return 26 - (- index_in - difference ) % 26
+        return (self._inverse[(index_in - 1 + self._offset) % 26] - self._offset) % 26 + 1
+
+    # Unchecked versions of the two methods above, for indices produced inside the machine
+    def _encode_rl(self, index_in):
+        return (self._wiring[(index_in - 1 + self._offset) % 26] - self._offset) % 26 + 1
+
+    def _encode_lr(self, index_in):
+        return (self._inverse[(index_in - 1 + self._offset) % 26] - self._offset) % 26 + 1
     
     def __str__(self):
         return (f"Rotor: {self._rotor_name}, Start Position: {self._start_pos}," +
                 f" Ring Position: {self._ring_pos}, Notch: {self._notch}," +
-                f" (Adj. Notch: {self._adjusted_notch}), Current Position: {self._rotor[0]}")
+                f" (Adj. Notch: {self._adjusted_notch}), Current Position: {Rotor._alphabet[self._offset]}")
     
     @classmethod
-    def custom_rotor(cls, rot_name, mapping, notch = [None], start_pos = "A", ring_pos = 1, pawl = True):
+    def custom_rotor(cls, rot_name, mapping, notch = [None], start_pos = "A", ring_pos = 1, pawl = True,
+                     registry = None):
         """Create a Rotor object will customisable name / mapping / notches / pawl"""
         
-        if set(mapping) != set(Rotor._alphabet):
-            raise ValueError("mapping must be all A-Z")
-        if notch != [None]:
-            for _notch in notch:
-                if _notch.isalpha() != True or len(_notch) != 1:
-                    raise ValueError("Notch must be letter A-Z or None")
-        if rot_name not in ["I", "II", "III", "IV", "V", "Beta","Gamma"]:
-            Rotor._rot_dict[rot_name] = mapping
-            Rotor._notch_dict[rot_name] = notch
-        return cls(rot_name, start_pos, ring_pos, pawl)
+        wheel = Wheel(rot_name, mapping, notch)
+        if rot_name in Rotor._rot_dict:
+            return cls(rot_name, start_pos, ring_pos, pawl)
+
+        # The wheel goes into the given session, or a private one; never the built in registry
+        registry = Rotor._registry.session() if registry == None else registry
+        registry.add_rotor(wheel)
+        return cls(rot_name, start_pos, ring_pos, pawl, registry)
         
 
 class Reflector(Rotor):
     """Creates Reflector object with functionality of reflector"""
 
-    def __init__(self, rot_name):
+    __slots__ = ("_reflector",)
+
+    def __init__(self, rot_name, registry = None, start_pos = "A"):
         self._rotor_check_str(rot_name)
+        if isinstance(start_pos, str) == False or len(start_pos) != 1 or start_pos.isalpha() == False:
+            raise ValueError("Letter A-Z")
+        wheel = (Rotor._registry if registry == None else registry).reflector(rot_name)
         
         self._rotor_name = rot_name 
+        self._start_pos = start_pos.upper()
         self._pawl = False
-        self._rotor = Rotor._alphabet
-        self._reflector = Reflector._reflectors[rot_name]
-        
-        self._mapping_rl = dict(zip(Rotor._alphabet, self._reflector))
-        self._mapping_lr = dict(zip(Rotor._alphabet, self._reflector))
+        self._offset = 0
+
+        # A reflector set to another position (on models with a settable UKW) is the same
+        # as a reflector at offset 0 with the wiring turned by that many letters; a moving
+        # reflector (Abwehr G) turns on from there
+        shift = ord(self._start_pos) - 65
+        self._wiring = bytes((wheel.forward[(idx + shift) % 26] - shift) % 26 for idx in range(26))
+        self._reflector = "".join(Rotor._alphabet[idx] for idx in self._wiring)
+
+        # A reflector is passed right to left only, both directions use the same wiring
+        self._inverse = self._wiring
         
     @classmethod
-    def custom_rotor(cls, rot_name, mapping):
-        if set(mapping) != set(Rotor._alphabet):
-            raise ValueError("mapping must be all A-Z")
-        if rot_name not in ["A","B","C"]:
-            Reflector._reflectors[rot_name] = mapping
-        return cls(rot_name)
+    def custom_rotor(cls, rot_name, mapping, registry = None):
+        wheel = Wheel(rot_name, mapping)
+        if rot_name in Rotor._reflectors:
+            return cls(rot_name)
+        registry = Rotor._registry.session() if registry == None else registry
+        registry.add_reflector(wheel)
+        return cls(rot_name, registry)
+
+    def reset(self):
+        """Moves the reflector back to the position it is set to"""
+
+        self._offset = 0
 
     def __str__(self):
+        if self._start_pos != "A":
+            return (f"Reflector: {self._rotor_name}, Position: {self._start_pos}")
         return (f"Reflector: {self._rotor_name}")
 
 class Rotor_spindle():
     """Creates Rotor_spindle object by combining mulitple rotors together"""
+
+    __slots__ = ("args",)
     
     def __init__(self, *args):
         
@@ -238,16 +600,8 @@ class Rotor_spindle():
     def rotate_spindle(self):
         """Internal rotation mechanism that is called when key is pressed"""
         
-        rotor_notch_pawl = []
-        
-        # Create a list of tuples. One tuple for each rotor.
-        # (True, False) would indicate Rotor is on its notch but does not have a pawl on its left
-        for idx in range(len(self.args)):
-            if self.args[idx]._adjusted_notch == [None]:
-                rotor_notch_pawl.append((None, self.args[idx]._pawl))
-            else:
-                rotor_notch_pawl.append((self.args[idx]._rotor[0] in self.args[idx]._adjusted_notch,
-                                        self.args[idx]._pawl))
+        # One boolean for each rotor; True if Rotor is on its notch and has a pawl on its left
+        engaged = [_rotor._engaged() for _rotor in self.args]
         
         # Rotation mechanism. Rotator rotated if current rotor on notch and has pawl on left
         # or previous rotor on notch and has pawl on left. Rotor on right always rotates.
@@ -255,8 +609,74 @@ class Rotor_spindle():
             if idx == 0:
                 self.args[idx].rotate()
             else:
-                if rotor_notch_pawl[idx-1] == (True, True) or rotor_notch_pawl[idx] == (True, True):
+                if engaged[idx-1] or engaged[idx]:
                     self.args[idx].rotate()
+
+    def wheels(self):
+        """Returns the wheels whose offsets make up the rotor positions, right to left: the
+        rotors, and a reflector if the spindle moves one"""
+
+        return self.args
+
+    def offsets(self):
+        """Returns a tuple of the rotor offsets (0-25), in the right to left order of .args"""
+
+        return tuple(_rotor.offset for _rotor in self.wheels())
+
+    def stepper(self):
+        """Returns a Stepper object modelling the stepping of the rotors"""
+
+        return Stepper([_rotor._engage_table() for _rotor in self.wheels()])
+
+    def schedule(self, n):
+        """Returns the rotor offsets after each of the next n keypresses, without rotating"""
+
+        return self.stepper().schedule(self.offsets(), n)
+
+    def seek(self, keypresses):
+        """Sets the rotors to the position reached after a number of keypresses"""
+
+        self.restore(self.stepper().advance(self.offsets(), keypresses))
+
+    def snapshot(self):
+        """Returns the rotor positions as a tuple of offsets (right to left), for restore"""
+
+        return self.offsets()
+
+    def restore(self, snapshot):
+        """Moves the rotors to the offsets of a snapshot (any sequence of integers). Without
+        an offset for a moving reflector, the reflector goes back to its set position."""
+
+        wheels = self.wheels()
+        if len(snapshot) != len(wheels) and len(snapshot) != len(self.args):
+            raise ValueError("One offset per rotor")
+        for _rotor in wheels[len(snapshot):]:
+            _rotor.reset()
+        for _rotor, offset in zip(wheels, snapshot):
+            _rotor.offset = offset
+
+    @staticmethod
+    def start_offsets(start_pos, ring_pos):
+        """Returns the offsets (right to left, for restore) of start letters and ring
+        positions given left to right. An offset is the start position less (ring position
+        - 1)."""
+
+        return tuple((ord(letter) - 64 - ring) % 26
+                     for letter, ring in zip(start_pos.upper()[::-1], ring_pos[::-1]))
+
+    @staticmethod
+    def start_letters(offsets, ring_pos):
+        """Returns the start letters (left to right) of offsets (right to left) and ring
+        positions (left to right); the reverse of start_offsets"""
+
+        return "".join(Rotor._alphabet[(offset + ring - 1) % 26]
+                       for offset, ring in zip(offsets, ring_pos[::-1]))[::-1]
+
+    def reset(self):
+        """Moves every rotor back to its start position"""
+
+        for _rotor in self.wheels():
+            _rotor.reset()
                         
     def _encode_right_to_left(self, index_in):
         """Encode a letter in a right to left manner"""
@@ -272,24 +692,370 @@ class Rotor_spindle():
             index_in = _rotor._encode_left_to_right(index_in)
         return index_in
 
+    # Unchecked versions of the two methods above, used by Enigma_machine
+    def _encode_rl(self, index_in):
+        for _rotor in self.args:
+            index_in = _rotor._encode_rl(index_in)
+        return index_in
+
+    def _encode_lr(self, index_in):
+        for _rotor in self.args[::-1]:
+            index_in = _rotor._encode_lr(index_in)
+        return index_in
+
     def __str__(self):
-        positions = [i._rotor[0] for i in self.args[::-1]]
+        positions = [Rotor._alphabet[i._offset] for i in self.args[::-1]]
         return (f"Rotor positions: {positions}")
 
+class Stepper():
+    """Creates Stepper object, an integer model of the Rotor_spindle stepping mechanism"""
+
+    __slots__ = ("_engage", "_to_notch", "_revolutions")
+
+    def __init__(self, engage):
+
+        if len(engage) == 0:
+            raise ValueError("Atleast one rotor required")
+
+        # One tuple per rotor (right to left), True at offsets where the pawl is engaged
+        self._engage = [tuple(bool(i) for i in table) for table in engage]
+
+        # Number of keypresses until the right hand rotor reaches an engaged offset
+        self._to_notch = []
+        for offset in range(26):
+            distances = [d for d in range(26) if self._engage[0][(offset + d) % 26]]
+            self._to_notch.append(distances[0] if distances else None)
+
+        self._revolutions = {}
+
+    def _slow_engaged(self, state):
+        """Returns True if any rotor left of the right hand rotor is engaged"""
+
+        return any(self._engage[i][state[i]] for i in range(1, len(state)))
+
+    def step(self, state):
+        """Returns the rotor offsets after a single keypress"""
+
+        engaged = [self._engage[i][state[i]] for i in range(len(state))]
+        return tuple((offset + (i == 0 or engaged[i-1] or engaged[i])) % 26
+                     for i, offset in enumerate(state))
+
+    def runs(self, state, n):
+        """Yields (first state, count) for runs of the next n keypresses in which only the
+        right hand rotor turns"""
+
+        done = 0
+        while done < n:
+            if self._slow_engaged(state) or self._engage[0][state[0]]:
+                state = self.step(state)
+                yield state, 1
+                done += 1
+                continue
+
+            distance = self._to_notch[state[0]]
+            count = n - done if distance == None else min(distance, n - done)
+            yield ((state[0] + 1) % 26,) + state[1:], count
+            state = ((state[0] + count) % 26,) + state[1:]
+            done += count
+
+    def schedule(self, state, n):
+        """Returns a list of the rotor offsets after each of the next n keypresses"""
+
+        schedule = []
+        for first, count in self.runs(state, n):
+            schedule.extend(((first[0] + i) % 26,) + first[1:] for i in range(count))
+        return schedule
+
+    def _after(self, state, n):
+        for first, count in self.runs(state, n):
+            state = ((first[0] + count - 1) % 26,) + first[1:]
+        return state
+
+    def advance(self, state, keypresses):
+        """Returns the rotor offsets after a number of keypresses, without visiting each one"""
+
+        # After 26 keypresses the right hand rotor is back where it started, so whole
+        # revolutions form a map on a finite set of states that must eventually cycle
+        revolutions, remainder = divmod(keypresses, 26)
+        seen = {state: 0}
+        history = [state]
+        for i in range(1, revolutions + 1):
+            if state not in self._revolutions:
+                self._revolutions[state] = self._after(state, 26)
+            state = self._revolutions[state]
+            if state in seen:
+                start = seen[state]
+                state = history[start + (revolutions - start) % (i - start)]
+                break
+            seen[state] = i
+            history.append(state)
+
+        return self._after(state, remainder)
+
+    def period(self, state):
+        """Returns (period, preperiod): the number of keypresses after which the rotor
+        positions repeat, and the number of keypresses before they enter that cycle"""
+
+        # The right hand rotor turns at every keypress, so the period is a whole number of
+        # revolutions; the cycle is found on the map of whole revolutions
+        seen = {state: 0}
+        history = [state]
+        while True:
+            if state not in self._revolutions:
+                self._revolutions[state] = self._after(state, 26)
+            state = self._revolutions[state]
+            if state in seen:
+                break
+            seen[state] = len(history)
+            history.append(state)
+
+        start = seen[state]
+        period = 26 * (len(history) - start)
+        if start == 0:
+            return period, 0
+
+        # The cycle is entered during the revolution before history[start]
+        previous = history[start - 1]
+        for keypresses in range(26):
+            position = self._after(previous, keypresses)
+            if self.advance(position, period) == position:
+                return period, 26 * (start - 1) + keypresses
+        return period, 26 * start
+
+class Gear_stepper(Stepper):
+    """Creates Gear_stepper object, a Stepper for cog-driven stepping (e.g. Abwehr G)"""
+
+    __slots__ = ()
+
+    def _slow_engaged(self, state):
+        # Cogs only turn a rotor together with the rotor on its right, so the slower rotors
+        # can only move when the right hand rotor is on a notch
+        return False
+
+    def step(self, state):
+        """Returns the rotor offsets after a single keypress"""
+
+        # Like an odometer: a rotor turns when the rotor on its right turns from a notch.
+        # There is no double step.
+        moved = []
+        turns = True
+        for i, offset in enumerate(state):
+            moved.append((offset + turns) % 26)
+            turns = turns and self._engage[i][offset]
+        return tuple(moved)
+
+class Gear_spindle(Rotor_spindle):
+    """Creates Gear_spindle object, a Rotor_spindle with cog-driven stepping. A reflector
+    given as reflector is turned by the left hand rotor, like one more rotor (Abwehr G)."""
+
+    __slots__ = ("_reflector",)
+
+    def __init__(self, *args, reflector = None):
+        super().__init__(*args)
+        if reflector != None and isinstance(reflector, Reflector) == False:
+            raise TypeError("Reflector instance only")
+        self._reflector = reflector
+
+    def wheels(self):
+        """Returns the wheels whose offsets make up the rotor positions, right to left: the
+        rotors, then the reflector if the spindle moves it"""
+
+        return self.args if self._reflector == None else self.args + (self._reflector,)
+
+    def rotate_spindle(self):
+        """Internal rotation mechanism that is called when key is pressed"""
+
+        # A rotor turns if the rotor on its right turns while on its notch (with a pawl, i.e.
+        # a cog, on its left). Rotor on right always rotates.
+        for _rotor in self.args:
+            engaged = _rotor._engaged()
+            _rotor.rotate()
+            if engaged == False:
+                break
+        else:
+            # The left hand rotor turned from a notch, so its cog turns the reflector
+            if self._reflector != None:
+                self._reflector.rotate()
+
+    def stepper(self):
+        """Returns a Gear_stepper object modelling the stepping of the rotors"""
+
+        return Gear_stepper([_rotor._engage_table() for _rotor in self.wheels()])
+
+# Wirings kept in the tables shared between machines; the built in wheels need far fewer
+_max_shared_wirings = 256
+
+class Permutation_cache():
+    """Creates Permutation_cache object, a thread-safe LRU cache of composed permutations"""
+
+    # Approximate size of one entry: the 26 permutations of 26 letters, the key and the dict slot
+    _entry_bytes = 2600
+
+    def __init__(self, maxsize = 17576, max_bytes = None):
+
+        if max_bytes != None:
+            maxsize = max_bytes // Permutation_cache._entry_bytes
+        if isinstance(maxsize, int) == False or maxsize < 1:
+            raise ValueError("Cache must hold atleast one entry")
+
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._permutations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key, factory, *args):
+        """Returns the entry stored for key, creating it with factory(*args) if missing"""
+
+        with self._lock:
+            permutation = self._permutations.get(key)
+            if permutation != None:
+                self._permutations.move_to_end(key)
+                self.hits += 1
+                return permutation
+            self.misses += 1
+
+        permutation = factory(*args)
+
+        with self._lock:
+            self._permutations[key] = permutation
+            if len(self._permutations) > self.maxsize:
+                self._permutations.popitem(last = False)
+                self.evictions += 1
+        return permutation
+
+    def clear(self):
+        with self._lock:
+            self._permutations.clear()
+
+    def info(self):
+        """Returns a dictionary of the cache counters"""
+
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "size": len(self._permutations), "maxsize": self.maxsize}
+
+    def __len__(self):
+        return len(self._permutations)
+
+    def __str__(self):
+        return (f"Permutation cache: {len(self)}/{self.maxsize} entries, " +
+                f"Hits: {self.hits}, Misses: {self.misses}")
+
+class Instrument():
+    """Base class of instruments attached to an Enigma_machine; the hooks do nothing"""
+
+    __slots__ = ()
+
+    # Stages of the encoding of a letter timed by the machine
+    stages = ("plugboard", "step", "etw", "spindle", "reflector")
+
+    def on_letter(self, letter_in, letter_out, plug_hits):
+        """Called for every letter; plug_hits is how many of its two passes through the
+        plugboard went through a lead (0-2)"""
+
+    def on_step(self, turnovers, double_steps):
+        """Called after every keypress with the indices (right to left) of the rotors turned
+        by the rotor on their right, and of those turned only by their own notch"""
+
+    def on_timing(self, seconds):
+        """Called once per call to encode with a dictionary of seconds spent in each stage"""
+
+class Encode_metrics(Instrument):
+    """Creates Encode_metrics object, thread-safe counters of instrumented encoding"""
+
+    __slots__ = ("letters", "plugboard_hits", "turnovers", "double_steps", "seconds", "_lock")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.letters = 0
+            self.plugboard_hits = 0
+            self.turnovers = {}
+            self.double_steps = {}
+            self.seconds = dict.fromkeys(Instrument.stages, 0.0)
+
+    def on_letter(self, letter_in, letter_out, plug_hits):
+        with self._lock:
+            self.letters += 1
+            self.plugboard_hits += plug_hits
+
+    def on_step(self, turnovers, double_steps):
+        if turnovers or double_steps:
+            with self._lock:
+                for idx in turnovers:
+                    self.turnovers[idx] = self.turnovers.get(idx, 0) + 1
+                for idx in double_steps:
+                    self.double_steps[idx] = self.double_steps.get(idx, 0) + 1
+
+    def on_timing(self, seconds):
+        with self._lock:
+            for stage, elapsed in seconds.items():
+                self.seconds[stage] = self.seconds.get(stage, 0.0) + elapsed
+
+    def info(self):
+        """Returns a dictionary of the counters"""
+
+        with self._lock:
+            return {"letters": self.letters, "plugboard_hits": self.plugboard_hits,
+                    "turnovers": dict(self.turnovers), "double_steps": dict(self.double_steps),
+                    "seconds": dict(self.seconds)}
+
+    def prometheus(self, prefix = "enigma"):
+        """Returns the counters in the Prometheus text exposition format"""
+
+        info = self.info()
+        lines = []
+        for name, help_text, samples in (
+                ("letters_total", "Letters encoded", [("", info["letters"])]),
+                ("plugboard_hits_total", "Passes through a plugboard lead",
+                 [("", info["plugboard_hits"])]),
+                ("turnovers_total", "Rotor turns caused by the rotor on the right",
+                 [(f'{{rotor="{idx}"}}', count) for idx, count in sorted(info["turnovers"].items())]),
+                ("double_steps_total", "Rotor turns caused by the rotor's own notch",
+                 [(f'{{rotor="{idx}"}}', count) for idx, count in sorted(info["double_steps"].items())]),
+                ("stage_seconds_total", "Time spent in each stage of encoding",
+                 [(f'{{stage="{stage}"}}', elapsed) for stage, elapsed in info["seconds"].items()])):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            lines.extend(f"{prefix}_{name}{labels} {value}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+    def __str__(self):
+        return (f"Encode metrics: {self.letters} letters, Plugboard hits: {self.plugboard_hits}, " +
+                f"Turnovers: {self.turnovers}, Double steps: {self.double_steps}")
+
 class Enigma_machine():
+
+        __slots__ = ("_plugboard", "_rotorspindle", "_reflector", "_cache", "_etw",
+                     "_etw_alphabet", "_alphabet_etw", "_instruments")
     
         _alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+        # Translate tables of the wheels of each wheel order, built for Permutation_cache.
+        # Bounded, as custom session wheels keep adding wirings.
+        _shared_translations = Permutation_cache(_max_shared_wirings)
+
+        # Dictionaries to allow numbers / integers to be converted
+        _alphabet_to_num = dict(zip(_alphabet, range(1,27)))
+        _num_to_alphabet = dict(zip(range(1,27), _alphabet))
     
-        def __init__(self, rotorspindle, reflector, plugboard = None, etw = None):
+        def __init__(self, rotorspindle, reflector, plugboard = None, etw = None, cache = None):
             
+            # A spindle which moves a reflector must move the machine's own reflector
+            if len(rotorspindle.wheels()) > len(rotorspindle.args):
+                if rotorspindle.wheels()[-1] is not reflector:
+                    raise ValueError("The spindle moves another reflector")
+
             self._plugboard = Plugboard() if plugboard == None else plugboard
             self._rotorspindle = rotorspindle
             self._reflector = reflector
+            self._cache = cache
+            self._instruments = None
             
-            # Create dictionaries to allow numbers / integers to be converted
-            self._alphabet_to_num = dict(zip(Enigma_machine._alphabet,range(1,27)))
-            self._num_to_alphabet = dict(zip(range(1,27),Enigma_machine._alphabet))  
-
             # Setup functionality of entry-wheel (not always present)
             if etw == None:
                 self._etw = None
@@ -301,79 +1067,845 @@ class Enigma_machine():
                     self._etw_alphabet = dict(zip(etw, Enigma_machine._alphabet))
                     self._alphabet_etw = dict(zip(Enigma_machine._alphabet, etw))
             
-        def encode(self, word, output = False):
-            """Will encode a string, output will return information on encoding process"""
+        @staticmethod
+        def _validate(word):
+            """Raises errors unless word is a non-empty string of letters A-Z / a-z"""
 
+            if isinstance(word, str) == False:
+                raise TypeError("Input a string")
             if word == "":
                 raise ValueError("Insert atleast one letter")
-                
-            for letter in word:
-                if letter.upper().isalpha() == False:
-                    raise ValueError("Inappropriate argument")
+            if word.isascii() == False or word.isalpha() == False:
+                raise ValueError("Inappropriate argument")
+
+        def encode(self, word, output = False, trusted = False):
+            """Will encode a string, output will return information on encoding process.
+            With trusted True, word must already be uppercase letters A-Z and is not checked."""
 
-            # Variables created to store information about encoding process (used in output)
-            rotor_names = [i._rotor_name for i in self._rotorspindle.args[::-1]]
-            start_pos = [i._start_pos for i in self._rotorspindle.args[::-1]]
-            ring_pos = [i._ring_pos for i in self._rotorspindle.args[::-1]]
-            pawls = [i._pawl for i in self._rotorspindle.args[::-1]]
+            # The word is checked once here; letters and indices inside the machine are not
+            # checked again
+            if trusted == False:
+                self._validate(word)
+                word = word.upper()
 
             if output:
+                # Variables created to store information about encoding process
+                rotor_names = [i._rotor_name for i in self._rotorspindle.args[::-1]]
+                start_pos = [i._start_pos for i in self._rotorspindle.args[::-1]]
+                ring_pos = [i._ring_pos for i in self._rotorspindle.args[::-1]]
+                pawls = [i._pawl for i in self._rotorspindle.args[::-1]]
                 print(f"Engima Machine - Rotor Names: {rotor_names}, Start Positions: {start_pos}, " + 
                     f"Ring Positions: {ring_pos}, Reflector: {self._reflector._rotor_name}, " +
                     f"Pawl on left: {pawls}")
 
-            encoding = ""
+            # Instruments take a separate loop, so the usual one costs nothing extra
+            if self._instruments != None:
+                return self._encode_instrumented(word, output)
 
-            for letter in word:
-                
-                # Encode letter through plugboard
-                letter_in = self._plugboard.encode(letter.upper())
-                
-                # Encode letter through entry wheel
-                if self._etw == None:
-                    etw_letter = letter_in
-                else:
-                    etw_letter = self._etw_alphabet[letter_in]
+            # The cache is looked up only when a rotor left of the right hand rotor moves.
+            # A single letter is cheaper through the rotors than setting up the lookups.
+            if self._cache != None and output == False and len(word) > 1:
+                return self._encode_cached(word)
 
-                # Establish entry index for spindle
-                spindle_idx_in = self._alphabet_to_num[etw_letter]
+            # The whole word goes through the plugboard at once, on the way in and out
+            plugboard = self._plugboard
+            scrambled = []
 
+            for letter, letter_in in zip(word, plugboard.translate(word)):
+                
                 # Save rotors settings / rotate / save rotor settings
-                rotor_setting_in = [i._rotor[0] for i in self._rotorspindle.args[::-1]]
+                if output:
+                    rotor_setting_in = [Rotor._alphabet[i._offset] for i in self._rotorspindle.args[::-1]]
                 self._rotorspindle.rotate_spindle()
-                rotor_setting_out = [i._rotor[0] for i in self._rotorspindle.args[::-1]]
-               
-                # Establish exit index from spindle
-                spindle_idx_out = self._rotorspindle._encode_right_to_left(spindle_idx_in)
-                
-                # Establish exit index from reflector
-                reflect_idx = self._reflector._encode_right_to_left(spindle_idx_out)
-                
-                # Establish exit index from spindle
-                spindle_idx_out_2 = self._rotorspindle._encode_left_to_right(reflect_idx)
-                
-                # Establish exit letter from spindle
-                letter_out = self._num_to_alphabet[spindle_idx_out_2]
-                
-                # Establish exit letter from entry wheel
-                if self._etw == None:
-                    etw_letter_out = letter_out
-                else:
-                    etw_letter_out = self._alphabet_etw[letter_out]
-                
-                # Establish encoded letter
-                encoded_letter = self._plugboard.encode(etw_letter_out)
+
+                # Encode letter through entry wheel, spindle and reflector
+                etw_letter_out = self._scramble(letter_in)
+                scrambled.append(etw_letter_out)
 
                 if output:
+                    encoded_letter = plugboard.translate(etw_letter_out)
+                    rotor_setting_out = [Rotor._alphabet[i._offset] for i in self._rotorspindle.args[::-1]]
+                    print(f"Start Position: {rotor_setting_in}, " + 
+                    f"Letter In: {letter}, End Position: {rotor_setting_out}, Letter Out: {encoded_letter}")
+
+            # Establish encoded letters
+            encoding = plugboard.translate("".join(scrambled))
+
+            if output:
+                return (f"Encoding: {encoding} ")
+            else:
+                return encoding
+
+        def instrument(self, *instruments):
+            """Attaches Instrument objects to the machine, replacing any attached before.
+            Without arguments the instruments are removed."""
+
+            for instrument in instruments:
+                if isinstance(instrument, Instrument) == False:
+                    raise TypeError("Instrument instances only")
+            self._instruments = tuple(instruments) if instruments else None
+
+        def _encode_instrumented(self, word, output = False):
+            """Encodes a string like encode, calling the hooks of the attached instruments"""
+
+            clock = time.perf_counter
+            plug_dict = self._plugboard.plug_dict
+            spindle = self._rotorspindle
+            rotors = spindle.args
+            seconds = dict.fromkeys(Instrument.stages, 0.0)
+            encoding = ""
+
+            for letter in word:
+                t0 = clock()
+                letter_in = plug_dict.get(letter, letter)
+                t1 = clock()
+
+                # Which rotors are on their notch decides why each rotor turns
+                engaged = [_rotor._engaged() for _rotor in rotors]
+                offsets_in = spindle.offsets()
+                rotor_setting_in = [Rotor._alphabet[i] for i in offsets_in[::-1]]
+                spindle.rotate_spindle()
+                t2 = clock()
+
+                etw_letter = letter_in if self._etw == None else self._etw_alphabet[letter_in]
+                t3 = clock()
+                idx = spindle._encode_rl(self._alphabet_to_num[etw_letter])
+                t4 = clock()
+                idx = self._reflector._encode_rl(idx)
+                t5 = clock()
+                idx = spindle._encode_lr(idx)
+                t6 = clock()
+                letter_out = self._num_to_alphabet[idx]
+                etw_letter_out = letter_out if self._etw == None else self._alphabet_etw[letter_out]
+                t7 = clock()
+                encoded_letter = plug_dict.get(etw_letter_out, etw_letter_out)
+                t8 = clock()
+
+                seconds["plugboard"] += (t1 - t0) + (t8 - t7)
+                seconds["step"] += t2 - t1
+                seconds["etw"] += (t3 - t2) + (t7 - t6)
+                seconds["spindle"] += (t4 - t3) + (t6 - t5)
+                seconds["reflector"] += t5 - t4
+
+                # A rotor which turned without the rotor on its right being on a notch was
+                # pushed by its own pawl: a double step
+                turned = [offset != _rotor._offset for offset, _rotor in zip(offsets_in, rotors)]
+                turnovers = tuple(i for i in range(1, len(rotors)) if turned[i] and engaged[i-1])
+                double_steps = tuple(i for i in range(1, len(rotors))
+                                     if turned[i] and engaged[i-1] == False)
+                plug_hits = (letter_in != letter) + (encoded_letter != etw_letter_out)
+                for instrument in self._instruments:
+                    instrument.on_step(turnovers, double_steps)
+                    instrument.on_letter(letter, encoded_letter, plug_hits)
+
+                if output:
+                    rotor_setting_out = [Rotor._alphabet[i._offset] for i in rotors[::-1]]
                     print(f"Start Position: {rotor_setting_in}, " + 
                     f"Letter In: {letter}, End Position: {rotor_setting_out}, Letter Out: {encoded_letter}")
 
                 encoding += encoded_letter
 
+            for instrument in self._instruments:
+                instrument.on_timing(seconds)
+
             if output:
                 return (f"Encoding: {encoding} ")
             else:
-                return encoding 
+                return encoding
+
+        def _scramble(self, letter_in):
+            """Encodes a letter through the entry wheel, spindle and reflector, and back"""
+
+            # Encode letter through entry wheel
+            if self._etw == None:
+                etw_letter = letter_in
+            else:
+                etw_letter = self._etw_alphabet[letter_in]
+
+            # Establish entry index for spindle
+            spindle_idx_in = self._alphabet_to_num[etw_letter]
+
+            # Establish exit index from spindle
+            spindle_idx_out = self._rotorspindle._encode_rl(spindle_idx_in)
+
+            # Establish exit index from reflector
+            reflect_idx = self._reflector._encode_rl(spindle_idx_out)
+
+            # Establish exit index from spindle
+            spindle_idx_out_2 = self._rotorspindle._encode_lr(reflect_idx)
+
+            # Establish exit letter from spindle
+            letter_out = self._num_to_alphabet[spindle_idx_out_2]
+
+            # Establish exit letter from entry wheel
+            if self._etw == None:
+                return letter_out
+            else:
+                return self._alphabet_etw[letter_out]
+
+        def _encode_cached(self, word):
+            """Encodes a string like encode, with the scramblers of the cache"""
+
+            spindle = self._rotorspindle
+            fast = spindle.args[0]
+            notches = set()
+            if fast._pawl == True:
+                notches = {ord(notch) - 65 for notch in fast._adjusted_notch if notch != None}
+            cache_key = self._cache_key()
+            inverses = tuple(_rotor._inverse for _rotor in spindle.args)
+            codes = self._plugboard.translate(word).encode("ascii").translate(Compiled_machine._to_code)
+            scrambled = bytearray(len(codes))
+            offset = fast._offset
+            rest = None
+
+            for i, code in enumerate(codes):
+
+                # Only the right hand rotor turns unless a pawl is engaged, as in
+                # Compiled_machine._encode_codes
+                if rest == None or slow_engaged or offset in notches:
+                    fast._offset = offset
+                    spindle.rotate_spindle()
+                    offset = fast._offset
+                    moved = spindle.offsets()[1:]
+                    if moved != rest:
+                        rest = moved
+                        slow_engaged = any(_rotor._engaged() for _rotor in spindle.args[1:])
+                        # One entry holds a scrambler for each offset of the right hand rotor
+                        scramblers = self._cache.lookup(cache_key + (rest,), self._scramblers,
+                                                        cache_key, inverses, rest)
+                else:
+                    offset = offset + 1 if offset != 25 else 0
+                scrambled[i] = scramblers[offset][code]
+
+            fast._offset = offset
+            return self._plugboard.translate(scrambled.decode("ascii"))
+
+        @staticmethod
+        def _translations(cache_key, inverses):
+            """Returns the translate tables (bytes of 256, one per rotor offset) composed by
+            _scramblers for the wheels of a cache key: the rotors left of the right hand rotor,
+            the reflector, the same rotors back, and (entry, exit) pairs taking letters through
+            the entry wheel and right hand rotor and back out. The tables are shared by all
+            machines using the same wheels."""
+
+            return Enigma_machine._shared_translations.lookup(
+                cache_key, Enigma_machine._build_translations, cache_key, inverses)
+
+        @staticmethod
+        def _build_translations(cache_key, inverses):
+            etw, wirings, reflector = cache_key
+            tables = lambda wiring: [bytes(table) + bytes(230)
+                                     for table in Compiled_machine._offset_tables(wiring)]
+
+            if etw == None:
+                entry, letters = Compiled_machine._codes, Compiled_machine._to_letter
+            else:
+                entry = bytes(etw.index(letter) for letter in Enigma_machine._alphabet)
+                letters = etw.encode("ascii") + bytes(230)
+            entry_exit = [(entry.translate(forward), backward.translate(letters))
+                          for forward, backward in zip(tables(wirings[0]), tables(inverses[0]))]
+
+            return ([tables(wiring) for wiring in wirings[1:]], tables(reflector),
+                    [tables(inverse) for inverse in inverses[1:]], entry_exit)
+
+        @staticmethod
+        def _scramblers(cache_key, inverses, rest):
+            """Returns, for each offset of the right hand rotor, the letters (as bytes) made by
+            the entry wheel, spindle and reflector with the other rotors at offsets rest"""
+
+            forward, reflector, backward, entry_exit = Enigma_machine._translations(cache_key, inverses)
+
+            # The rotors left of the right hand rotor and the reflector, as in
+            # Compiled_machine._compose_inner, composed one whole table at a time. A moving
+            # reflector's offset follows the rotor offsets.
+            inner = Compiled_machine._codes
+            for tables, offset in zip(forward, rest):
+                inner = inner.translate(tables[offset])
+            moved = rest[len(forward)] if len(rest) > len(forward) else 0
+            inner = inner.translate(reflector[moved])
+            for tables, offset in zip(backward[::-1], rest[len(backward) - 1::-1]):
+                inner = inner.translate(tables[offset])
+            inner += bytes(230)
+
+            # Entry wheel and right hand rotor in, and back out to letters
+            return tuple(entry.translate(inner).translate(exit_) for entry, exit_ in entry_exit)
+
+        def _cache_key(self):
+            """Returns the wirings of the entry wheel, rotors and reflector. The ring
+            positions are part of the rotor offsets which complete the key."""
+
+            wirings = tuple(_rotor._wiring for _rotor in self._rotorspindle.args)
+            return (self._etw, wirings, self._reflector._wiring)
+
+        @classmethod
+        def from_key(cls, key, cache = None, registry = None):
+            """Builds a machine from a key dictionary; see readme.md for its fields. Wheel
+            names are looked up in registry, or the built in wheels. A key naming a "model"
+            is built by that Machine_model, with its own wheels."""
+
+            if "model" in key:
+                return Machine_model.get(key["model"]).machine(key, cache)
+
+            rotors = key["rotors"]
+            start_pos = key.get("start_pos", "A" * len(rotors))
+            ring_pos = key.get("ring_pos", [1] * len(rotors))
+            if len(start_pos) != len(rotors) or len(ring_pos) != len(rotors):
+                raise ValueError("One start position and ring position per rotor")
+
+            # Rotors given left to right. As on the military machines only the two right
+            # hand rotors have a pawl on their left.
+            spindle = Rotor_spindle(*[Rotor(name, start, ring, i >= len(rotors) - 2, registry)
+                                      for i, (name, start, ring)
+                                      in enumerate(zip(rotors, start_pos, ring_pos))])
+            plugboard = Plugboard()
+            if key.get("plugboard"):
+                plugboard.multiple_adds(*key["plugboard"])
+            return cls(spindle, Reflector(key["reflector"], registry), plugboard, key.get("etw"), cache)
+
+        def snapshot(self):
+            """Returns the rotor positions as a tuple of offsets (right to left). Snapshots
+            are plain integers, so they can be saved as JSON and restored on another machine
+            with the same key."""
+
+            return self._rotorspindle.snapshot()
+
+        def restore(self, snapshot):
+            """Moves the rotors to the positions of a snapshot"""
+
+            self._rotorspindle.restore(snapshot)
+
+        def reset(self):
+            """Moves the rotors back to their start positions, so the machine can be reused"""
+
+            self._rotorspindle.reset()
+
+        def compile(self):
+            """Returns a Compiled_machine built from the current setup and rotor positions"""
+
+            return Compiled_machine(self._rotorspindle, self._reflector, self._plugboard, self._etw)
+
+        def encode_into(self, data, out = None, codes = False):
+            """Encodes a buffer of ASCII letters (or codes 0-25) into out, as
+            Compiled_machine.encode_into, and moves the rotors on. Each call compiles the
+            machine, so compile once for many buffers."""
+
+            # Instruments see every letter, so they take the usual encode
+            if self._instruments != None:
+                source = Compiled_machine._byte_view(data).tobytes()
+                if codes:
+                    if source.translate(None, Compiled_machine._codes):
+                        raise ValueError("Codes 0-25 only")
+                    source = source.translate(Compiled_machine._to_letter)
+                encoded = self.encode(source.decode("ascii")).encode("ascii")
+                if codes:
+                    encoded = encoded.translate(Compiled_machine._to_code)
+                if out is None:
+                    return bytearray(encoded)
+                Compiled_machine._byte_view(out)[:] = encoded
+                return out
+
+            compiled = self.compile()
+            out = compiled.encode_into(data, out, codes)
+            self._rotorspindle.restore(compiled.offsets())
+            return out
+
+class Compiled_machine():
+    """Creates Compiled_machine object, an integer-table copy of an Enigma_machine"""
+
+    __slots__ = ("_forward", "_backward", "_reflect", "_entry", "_exit", "_stepper",
+                 "_offsets", "_start", "_inner", "_slow_engaged", "_n_rotors")
+
+    # Offset tables of the wirings; bounded, as custom session wheels keep adding wirings
+    _shared_tables = Permutation_cache(_max_shared_wirings)
+
+    _alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    _to_code = bytes.maketrans(b"ABCDEFGHIJKLMNOPQRSTUVWXYZ", bytes(range(26)))
+    _to_letter = bytes.maketrans(bytes(range(26)), b"ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+    # Letters of either case to codes; everything else to 255, so the 0-25 check fails
+    _letters_to_code = bytes(letter - 65 if 65 <= letter <= 90 else letter - 97 if 97 <= letter <= 122
+                             else 255 for letter in range(256))
+    _codes = bytes(range(26))
+
+    def __init__(self, rotorspindle, reflector, plugboard = None, etw = None):
+        alphabet = Compiled_machine._alphabet
+        plugboard = Plugboard() if plugboard == None else plugboard
+
+        if len(rotorspindle.args) == 0:
+            raise ValueError("Atleast one rotor required")
+
+        # Plugboard and entry wheel as permutations of the integers 0-25
+        plug = list(plugboard.permutation)
+        if etw == None:
+            etw_in = list(range(26))
+            etw_out = list(range(26))
+        else:
+            etw_in = [etw.index(letter) for letter in alphabet]
+            etw_out = [alphabet.index(letter) for letter in etw]
+
+        # Per rotor (right to left): wiring tables for every offset
+        self._forward = []
+        self._backward = []
+        for _rotor in rotorspindle.args:
+            self._forward.append(self._offset_tables(_rotor._wiring))
+            self._backward.append(self._offset_tables(_rotor._inverse))
+        self._stepper = rotorspindle.stepper()
+        self._offsets = rotorspindle.offsets()
+        self._start = self._offsets
+        self._n_rotors = len(rotorspindle.args)
+
+        # A moving reflector is passed once, so it is one more wheel with no way back and
+        # the reflection is folded into its tables
+        if len(self._offsets) > self._n_rotors:
+            self._forward.append(self._offset_tables(reflector._wiring))
+            self._backward.append(self._offset_tables(Compiled_machine._codes))
+            self._reflect = list(range(26))
+        else:
+            self._reflect = list(reflector._wiring)
+
+        # Fold plugboard / entry wheel into the tables of the right hand rotor
+        self._entry = [[forward[etw_in[plug[code]]] for code in range(26)]
+                       for forward in self._forward[0]]
+        self._exit = [[plug[etw_out[backward[idx]]] for idx in range(26)]
+                      for backward in self._backward[0]]
+
+        self._update_inner()
+
+    @staticmethod
+    def _byte_view(data):
+        """Returns a flat memoryview of a buffer of single bytes. Wider items (array('H'),
+        numpy int arrays, ...) are refused rather than read as their separate bytes."""
+
+        view = memoryview(data)
+        if view.itemsize != 1:
+            raise TypeError("Buffer of single byte items required")
+        return view.cast("B")
+
+    @staticmethod
+    def _offset_tables(wiring):
+        """Returns 26 lists, mapping entry index to exit index for each rotor offset. The
+        lists are shared by all machines using the same wiring and must not be changed."""
+
+        return Compiled_machine._shared_tables.lookup(wiring, Compiled_machine._build_offset_tables, wiring)
+
+    @staticmethod
+    def _build_offset_tables(wiring):
+        return [[(wiring[(idx + offset) % 26] - offset) % 26 for idx in range(26)]
+                for offset in range(26)]
+
+    def _compose_inner(self, offsets):
+        """Returns the permutation of the rotors left of the right hand rotor and the
+        reflector, for the given offsets"""
+
+        slow = range(1, len(offsets))
+        inner = []
+        for idx in range(26):
+            for i in slow:
+                idx = self._forward[i][offsets[i]][idx]
+            idx = self._reflect[idx]
+            for i in reversed(slow):
+                idx = self._backward[i][offsets[i]][idx]
+            inner.append(idx)
+        return inner
+
+    def _update_inner(self):
+        self._inner = self._compose_inner(self._offsets)
+        self._slow_engaged = self._stepper._slow_engaged(self._offsets)
+
+    def offsets(self):
+        """Returns a tuple of the rotor offsets (0-25), right to left"""
+
+        return self._offsets
+
+    def seek(self, keypresses):
+        """Moves the rotors to the position reached after a number of keypresses"""
+
+        self._offsets = self._stepper.advance(self._offsets, keypresses)
+        self._update_inner()
+
+    def snapshot(self):
+        """Returns the rotor offsets (right to left), for restore"""
+
+        return self._offsets
+
+    def restore(self, snapshot):
+        """Moves the rotors to the offsets of a snapshot; the wiring tables are kept.
+        Without an offset for a moving reflector, the reflector goes back to its set
+        position."""
+
+        if len(snapshot) != len(self._offsets) and len(snapshot) != self._n_rotors:
+            raise ValueError("One offset per rotor")
+        self._offsets = tuple(offset % 26 for offset in snapshot) + (0,) * (len(self._offsets) - len(snapshot))
+        self._update_inner()
+
+    def reset(self):
+        """Moves the rotors back to the positions the machine was compiled at"""
+
+        self.restore(self._start)
+
+    def permutations(self, n):
+        """Returns the substitution made at each of the next n keypresses, as lists of 26
+        codes, without moving the rotors"""
+
+        permutations = []
+        for first, count in self._stepper.runs(self._offsets, n):
+            inner = self._compose_inner(first)
+            for i in range(count):
+                offset = (first[0] + i) % 26
+                entry = self._entry[offset]
+                exit_ = self._exit[offset]
+                permutations.append([exit_[inner[entry[code]]] for code in range(26)])
+        return permutations
+
+    def _encode_codes(self, data, out):
+        """Encodes letter codes 0-25 from data into the preallocated buffer out"""
+
+        step = self._stepper.step
+        engage = self._stepper._engage[0]
+        entry = self._entry
+        exit_ = self._exit
+        inner = self._inner
+        slow_engaged = self._slow_engaged
+        rest = self._offsets[1:]
+        offset = self._offsets[0]
+
+        for i, code in enumerate(data):
+            # Only the right hand rotor turns unless a pawl is engaged
+            if slow_engaged or engage[offset]:
+                self._offsets = step((offset,) + rest)
+                self._update_inner()
+                rest = self._offsets[1:]
+                offset = self._offsets[0]
+                inner = self._inner
+                slow_engaged = self._slow_engaged
+            else:
+                offset = offset + 1 if offset != 25 else 0
+            out[i] = exit_[offset][inner[entry[offset][code]]]
+
+        self._offsets = (offset,) + rest
+
+    def encode(self, word, trusted = False):
+        """Will encode a string, returning the same result as Enigma_machine.encode. With
+        trusted True, word must already be uppercase letters A-Z and is not checked."""
+
+        if trusted == False:
+            Enigma_machine._validate(word)
+            word = word.upper()
+
+        data = word.encode("ascii").translate(Compiled_machine._to_code)
+        out = bytearray(len(data))
+        self._encode_codes(data, out)
+        return out.translate(Compiled_machine._to_letter).decode("ascii")
+
+    def encode_into(self, data, out = None, codes = False):
+        """Encodes a buffer (bytes, bytearray, memoryview, array, ...) of ASCII letters, or
+        of codes 0-25 with codes True, into out: a writable buffer of the same length, which
+        may be data itself. Results are uppercase letters, or codes with codes True. Returns
+        out, a new bytearray if none was given."""
+
+        source = Compiled_machine._byte_view(data)
+        if out is None:
+            out = bytearray(len(source))
+        target = Compiled_machine._byte_view(out)
+        if target.readonly:
+            raise TypeError("Writable output buffer required")
+        if len(target) != len(source):
+            raise ValueError("Output buffer must have the length of the input")
+
+        # The checks and the conversion between letters and codes run on whole buffers
+        if codes:
+            if source.tobytes().translate(None, Compiled_machine._codes):
+                raise ValueError("Codes 0-25 only")
+        else:
+            source = source.tobytes().translate(Compiled_machine._letters_to_code)
+            if source.translate(None, Compiled_machine._codes):
+                raise ValueError("ASCII letters only")
+        self._encode_codes(source, target)
+        if codes == False:
+            target[:] = target.tobytes().translate(Compiled_machine._to_letter)
+        return out
+
+    def __str__(self):
+        positions = [Compiled_machine._alphabet[i] for i in self._offsets[::-1]]
+        return (f"Compiled machine, Rotor positions: {positions}")
+
+class Enigma_stream():
+    """Creates Enigma_stream object which encodes text or bytes chunk by chunk, keeping
+    the rotor positions between chunks"""
+
+    _policies = ("pass", "strip", "error")
+    _split_str = re.compile(r"([^A-Za-z]+)")
+    _split_bytes = re.compile(rb"([^A-Za-z]+)")
+
+    def __init__(self, machine, non_alpha = "pass"):
+
+        if non_alpha not in Enigma_stream._policies:
+            raise ValueError(f"non_alpha must be one of {Enigma_stream._policies}")
+        if isinstance(machine, Enigma_machine):
+            machine = machine.compile()
+        if isinstance(machine, Compiled_machine) == False:
+            raise TypeError("Enigma_machine or Compiled_machine instance only")
+
+        self._machine = machine
+        self._non_alpha = non_alpha
+
+    def _encode_letters(self, letters):
+        """Encodes ASCII letters (bytes), returning uppercase bytes"""
+
+        data = letters.upper().translate(Compiled_machine._to_code)
+        out = bytearray(len(data))
+        self._machine._encode_codes(data, out)
+        return bytes(out.translate(Compiled_machine._to_letter))
+
+    def encode(self, chunk):
+        """Encodes one chunk of str or bytes, returning the same type"""
+
+        text = isinstance(chunk, str)
+        split = Enigma_stream._split_str if text else Enigma_stream._split_bytes
+        parts = split.split(chunk if text else bytes(chunk))
+
+        # parts alternates between runs of letters and runs of anything else
+        if len(parts) > 1 and self._non_alpha == "error":
+            raise ValueError("Inappropriate argument")
+        letters = "".join(parts[0::2]).encode("ascii") if text else b"".join(parts[0::2])
+        encoded = self._encode_letters(letters)
+
+        if len(parts) > 1 and self._non_alpha == "pass":
+            pieces = []
+            start = 0
+            for i, part in enumerate(parts):
+                if i % 2 == 0:
+                    pieces.append(encoded[start:start + len(part)])
+                    start += len(part)
+                else:
+                    pieces.append(part.encode("utf-8") if text else part)
+            encoded = b"".join(pieces)
+        return encoded.decode("utf-8") if text else encoded
+
+    def encode_iter(self, chunks):
+        """Generator which yields the encoding of each chunk in an iterable of chunks"""
+
+        for chunk in chunks:
+            yield self.encode(chunk)
+
+    def encode_file(self, source, destination, chunk_size = 1 << 20):
+        """Encodes a file object (text or binary) into another, chunk_size at a time"""
+
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            destination.write(self.encode(chunk))
+
+class Random_access():
+    """Creates Random_access object which decodes any part of a long message without
+    stepping the rotors through everything before it"""
+
+    def __init__(self, machine, interval = 1 << 16):
+
+        if isinstance(machine, Enigma_machine):
+            machine = machine.compile()
+        if isinstance(machine, Compiled_machine) == False:
+            raise TypeError("Enigma_machine or Compiled_machine instance only")
+        if isinstance(interval, int) == False or interval < 1:
+            raise ValueError("Interval must be a positive integer")
+
+        self._machine = machine
+        self._stepper = machine._stepper
+        self._interval = interval
+        self._lock = threading.Lock()
+
+        # Sparse index: rotor offsets after every interval keypresses, filled in when needed
+        self._states = {0: machine.snapshot()}
+
+    def state(self, keypresses):
+        """Returns the rotor offsets (right to left) after a number of keypresses"""
+
+        if keypresses < 0:
+            raise ValueError("Keypresses must not be negative")
+        block, rest = divmod(keypresses, self._interval)
+        if block not in self._states:
+            self._states[block] = self._stepper.advance(self._states[0], block * self._interval)
+        return self._stepper.advance(self._states[block], rest) if rest else self._states[block]
+
+    def decode(self, text, keypresses = 0, non_alpha = "pass"):
+        """Decodes (or encodes) a piece of a message which starts after the given number of
+        keypresses. Non letters are handled as by Enigma_stream."""
+
+        state = self.state(keypresses)
+        with self._lock:
+            self._machine.restore(state)
+            return Enigma_stream(self._machine, non_alpha).encode(text)
+
+    def letter_index(self, data):
+        """Returns a list holding the number of letters before every interval characters of
+        data (str or bytes), for decode_range on messages with non letters"""
+
+        split = Enigma_stream._split_str if isinstance(data, str) else Enigma_stream._split_bytes
+        index = [0]
+        for start in range(0, len(data), self._interval):
+            index.append(index[-1] + len(split.sub(data[:0], data[start:start + self._interval])))
+        return index
+
+    def decode_range(self, data, start, stop, letter_index = None):
+        """Decodes data[start:stop]. Without a letter index data must be letters only; with
+        one (see letter_index) non letters are passed through and do not turn the rotors."""
+
+        if letter_index == None:
+            keypresses = start
+        else:
+            block = start // self._interval
+            split = Enigma_stream._split_str if isinstance(data, str) else Enigma_stream._split_bytes
+            keypresses = letter_index[block] + len(split.sub(data[:0], data[block * self._interval:start]))
+        return self.decode(data[start:stop], keypresses)
+
+    def __str__(self):
+        return (f"Random access: interval {self._interval}, {len(self._states)} indexed positions")
+
+class Machine_model():
+    """Creates Machine_model object, the wheels, stepping and fittings of an Enigma model.
+
+    positions lists the rotor names allowed in each rotor position, left to right. Rotor
+    and reflector names are looked up in the model's own registry, so different models can
+    use the same names (e.g. "I") for different wirings.
+    """
+
+    __slots__ = ("name", "registry", "positions", "reflectors", "spindle", "etw", "plugboard",
+                 "settable_reflector", "moving_reflector")
+
+    _models = {}
+
+    def __init__(self, name, registry, positions, reflectors, spindle = Rotor_spindle, etw = None,
+                 plugboard = True, settable_reflector = False, moving_reflector = False):
+
+        if len(positions) == 0:
+            raise ValueError("Atleast one rotor required")
+        if issubclass(spindle, Rotor_spindle) == False:
+            raise TypeError("spindle must be Rotor_spindle or a subclass")
+        if moving_reflector and issubclass(spindle, Gear_spindle) == False:
+            raise ValueError("A moving reflector needs Gear_spindle or a subclass")
+        for names in positions:
+            for rot_name in names:
+                registry.rotor(rot_name)
+        for rot_name in reflectors:
+            registry.reflector(rot_name)
+
+        self.name = name
+        self.registry = registry
+        self.positions = tuple(tuple(names) for names in positions)
+        self.reflectors = tuple(reflectors)
+        self.spindle = spindle
+        self.etw = etw
+        self.plugboard = plugboard
+        self.settable_reflector = settable_reflector
+        self.moving_reflector = moving_reflector
+
+    @classmethod
+    def register(cls, model):
+        """Adds a model, so keys can name it with "model"; ValueError if the name is taken"""
+
+        if isinstance(model, Machine_model) == False:
+            raise TypeError("Machine_model instances only")
+        if cls._models.get(model.name, model) is not model:
+            raise ValueError(f"Model {model.name} is already defined")
+        cls._models[model.name] = model
+        return model
+
+    @classmethod
+    def get(cls, name):
+        """Returns a registered model; KeyError if the name is unknown"""
+
+        return cls._models[name]
+
+    @classmethod
+    def names(cls):
+        return list(cls._models)
+
+    def machine(self, key, cache = None):
+        """Builds an Enigma_machine of this model from a key dictionary, checking the key
+        against the model. "reflector_pos" sets a settable reflector (default "A")."""
+
+        rotors = key["rotors"]
+        if len(rotors) != len(self.positions):
+            raise ValueError(f"The {self.name} takes {len(self.positions)} rotors")
+        for position, (rot_name, names) in enumerate(zip(rotors, self.positions), 1):
+            if rot_name not in names:
+                raise ValueError(f"Rotor {rot_name} can't be used in position {position} of the {self.name}")
+        start_pos = key.get("start_pos", "A" * len(rotors))
+        ring_pos = key.get("ring_pos", [1] * len(rotors))
+        if len(start_pos) != len(rotors) or len(ring_pos) != len(rotors):
+            raise ValueError("One start position and ring position per rotor")
+
+        reflector = key.get("reflector", self.reflectors[0])
+        if reflector not in self.reflectors:
+            raise ValueError(f"Reflector {reflector} is not used in the {self.name}")
+        reflector_pos = key.get("reflector_pos", "A")
+        if reflector_pos != "A" and self.settable_reflector == False:
+            raise ValueError(f"The reflector of the {self.name} can't be set")
+        if key.get("plugboard") and self.plugboard == False:
+            raise ValueError(f"The {self.name} has no plugboard")
+        if key.get("etw", self.etw) != self.etw:
+            raise ValueError(f"The entry wheel of the {self.name} is fixed")
+
+        # Rotors given left to right; only the two right hand rotors have a pawl (or, on
+        # cog-driven machines, a cog) on their left. A moving reflector is turned by a cog
+        # on the left hand rotor.
+        rotors = [Rotor(rot_name, start, ring, i >= len(rotors) - 2 or self.moving_reflector, self.registry)
+                  for i, (rot_name, start, ring) in enumerate(zip(rotors, start_pos, ring_pos))]
+        reflector = Reflector(reflector, self.registry, reflector_pos)
+        if self.moving_reflector:
+            spindle = self.spindle(*rotors, reflector = reflector)
+        else:
+            spindle = self.spindle(*rotors)
+        plugboard = Plugboard()
+        if key.get("plugboard"):
+            plugboard.multiple_adds(*key["plugboard"])
+        return Enigma_machine(spindle, reflector, plugboard, self.etw, cache)
+
+    def __str__(self):
+        return (f"Machine model: {self.name}, Rotors: {[list(names) for names in self.positions]}, " +
+                f"Reflectors: {list(self.reflectors)}")
+
+# Built in models. The wirings of each model are kept in a frozen registry of its own; the
+# Kriegsmarine wheels are layered on top of the built in wheels.
+_naval = Wiring_registry([Wheel("VI", "JPGVOUMFYQBENHZRDKASXLICTW", ["Z", "M"]),
+                          Wheel("VII", "NZJHGRCXMYSWBOUFAIVLPEKQDT", ["Z", "M"]),
+                          Wheel("VIII", "FKQHTLXOCBJSPDZRAMEWNIUYGV", ["Z", "M"])],
+                         [Wheel("BThin", "ENKQAUYWJICOPBLMDXZVFTHRGS"),
+                          Wheel("CThin", "RDOBJNTKVEHMLFCWZAXGYIPSUQ")],
+                         parent = Rotor._registry, frozen = True)
+_naval_rotors = ("I", "II", "III", "IV", "V", "VI", "VII", "VIII")
+_qwertz = "QWERTZUIOASDFGHJKPYXCVBNML"
+
+Machine_model.register(Machine_model("M3", _naval, [_naval_rotors] * 3, ("B", "C")))
+Machine_model.register(Machine_model("M4", _naval, [("Beta", "Gamma")] + [_naval_rotors] * 3,
+                                     ("BThin", "CThin")))
+Machine_model.register(Machine_model(
+    "Railway", Wiring_registry.from_dicts({"I": "JGDQOXUSCAMIFRVTPNEWKBLZYH",
+                                           "II": "NTZPSFBOKMWRCJDIVLAEYUXHGQ",
+                                           "III": "JVIUBHTCDYAKEQZPOSGXNRMWFL"},
+                                          {"I": ["N"], "II": ["E"], "III": ["Y"]},
+                                          {"UKW": "QYHOGNECVPUZTFDJAXWMKISRBL"}),
+    [("I", "II", "III")] * 3, ("UKW",), etw = _qwertz, plugboard = False, settable_reflector = True))
+Machine_model.register(Machine_model(
+    "Swiss-K", Wiring_registry.from_dicts({"I": "PEZUOHXSCVFMTBGLRINQJWAYDK",
+                                           "II": "ZOUESYDKFWPCIQXHMVBLGNJRAT",
+                                           "III": "EHRVXGAOBQUSIMZFLYNWKTPDJC"},
+                                          {"I": ["Y"], "II": ["E"], "III": ["N"]},
+                                          {"UKW": "IMETCGFRAYSQBZXWLHKDVUPOJN"}),
+    [("I", "II", "III")] * 3, ("UKW",), etw = _qwertz, plugboard = False, settable_reflector = True))
+
+# The Abwehr G (G-312) has wheels with 11 to 17 notches driven by cogs. Its reflector is
+# set to a position and turned by the left hand rotor like a fourth wheel.
+Machine_model.register(Machine_model(
+    "Abwehr G", Wiring_registry.from_dicts({"I": "DMTWSILRUYQNKFEJCAZBPGXOHV",
+                                            "II": "HQZGPJTMOBLNCIFDYAWVEUSRKX",
+                                            "III": "UQNTLSZFMREHDPXKIBVYGJCWOA"},
+                                           {"I": list("SUVWZABCEFGIKLOPQ"),
+                                            "II": list("STVYZACDFGHKMNQ"),
+                                            "III": list("UWXAEFHKMNR")},
+                                           {"UKW": "RULQMZJSYGOCETKWDAHNBXPVIF"}),
+    [("I", "II", "III")] * 3, ("UKW",), spindle = Gear_spindle, etw = _qwertz, plugboard = False,
+    settable_reflector = True, moving_reflector = True))
 
 if __name__ == "__main__":
     print("-----PlugLead checks-----")
@@ -405,10 +1937,11 @@ if __name__ == "__main__":
     print("")
 
     print("-----Customised rotor check (double notchs)-----")
+    session = Rotor._registry.session()
     r3 = Rotor.custom_rotor("VIII", "FKQHTLXOCBJSPDZRAMEWNIUYGV", notch = ["H","U"],
-     start_pos = "A", ring_pos = 1, pawl = True)
+     start_pos = "A", ring_pos = 1, pawl = True, registry = session)
     print(r3)
-    print(Rotor._rot_dict)
+    print(session.rotor_names())
     print("")
 
     print("-----Reflector check-----")
@@ -417,9 +1950,9 @@ if __name__ == "__main__":
     print("")
 
     print("-----Custom _reflector check-----")
-    r5 = Reflector.custom_rotor("BTHIN", "ENKQAUYWJICOPBLMDXZVFTHRGS")
+    r5 = Reflector.custom_rotor("BTHIN", "ENKQAUYWJICOPBLMDXZVFTHRGS", registry = session)
     print(r5)
-    print(Rotor._reflectors)
+    print(session.reflector_names())
     print("")
 
     print("-----Rotor_spindle check-----")
@@ -0,0 +1,202 @@
+import argparse
+import itertools
+import sqlite3
+import sys
+import time
+
+from enigma import Enigma_machine, Rotor, Rotor_spindle
+
+### Cycle structure analysis. Every substitution made by the machine is a product of 13
+### swaps, but the product of the substitutions at two positions three keypresses apart
+### (Rejewski's AD, BE and CF) has cycles that depend on the rotor settings. The plugboard
+### only relabels the letters, so the cycle lengths (the 'characteristic') depend on the
+### wheel order, reflector, rings and start position alone. Cycle_catalog stores the
+### characteristic of every start position of chosen wheel orders in an SQLite file
+### indexed by signature, so a characteristic found from intercepted indicators is looked
+### up directly instead of trying every setting again.
+###
+
+def cycles(permutation):
+    """Returns the cycles of a permutation of 0-25 (a list), as tuples, longest first"""
+
+    seen = [False] * len(permutation)
+    found = []
+    for start in range(len(permutation)):
+        if seen[start] == False:
+            cycle = []
+            idx = start
+            while seen[idx] == False:
+                seen[idx] = True
+                cycle.append(idx)
+                idx = permutation[idx]
+            found.append(tuple(cycle))
+    return sorted(found, key = len, reverse = True)
+
+def cycle_structure(permutation):
+    """Returns the lengths of the cycles of a permutation, longest first"""
+
+    return tuple(len(cycle) for cycle in cycles(permutation))
+
+def product(first, then):
+    """Returns the permutation applying first and then then"""
+
+    return [then[idx] for idx in first]
+
+def characteristic(permutations, distance = 3):
+    """Returns the cycle structures of the products of the substitutions distance
+    keypresses apart, e.g. (AD, BE, CF) for six substitutions A-F"""
+
+    return tuple(cycle_structure(product(permutations[i], permutations[i + distance]))
+                 for i in range(distance))
+
+def signature(structures):
+    """Returns a characteristic as a string, e.g. '13.13/10.10.3.3/...' """
+
+    return "/".join(".".join(str(length) for length in structure) for structure in structures)
+
+def products_from_indicators(indicators, distance = 3):
+    """Returns the products AD, BE, CF (lists of 26 codes, None where unknown) read from
+    enciphered doubled indicators, e.g. 'DMQVBN' for a message key typed twice"""
+
+    products = [[None] * 26 for _ in range(distance)]
+    for indicator in indicators:
+        codes = [ord(letter) - 65 for letter in indicator.upper()]
+        if len(codes) != 2 * distance or min(codes) < 0 or max(codes) > 25:
+            raise ValueError(f"Indicator of {2 * distance} letters A-Z required: {indicator}")
+        for i in range(distance):
+            known = products[i][codes[i]]
+            if known != None and known != codes[i + distance]:
+                raise ValueError(f"Indicators disagree: {indicator}")
+            products[i][codes[i]] = codes[i + distance]
+    return products
+
+def characteristic_from_indicators(indicators, distance = 3):
+    """Returns the characteristic given by a day's indicators, or None until every letter
+    of every product is known"""
+
+    products = products_from_indicators(indicators, distance)
+    if any(None in permutation for permutation in products):
+        return None
+    return tuple(cycle_structure(permutation) for permutation in products)
+
+def period(key):
+    """Returns (period, preperiod) of the stepping of the machine built from a key"""
+
+    spindle = Enigma_machine.from_key(key)._rotorspindle
+    return spindle.stepper().period(spindle.offsets())
+
+def characteristics(key, distance = 3):
+    """Yields (start_pos, characteristic) for every start position of a key's wheel order,
+    reflector and rings; the plugboard of the key is left out"""
+
+    key = dict(key, plugboard = [])
+    n_rotors = len(key["rotors"])
+    rings = key.get("ring_pos", [1] * n_rotors)
+    machine = Enigma_machine.from_key(key).compile()
+
+    for start in itertools.product(range(26), repeat = n_rotors):
+        start_pos = "".join(Rotor._alphabet[offset] for offset in start)
+        machine.restore(Rotor_spindle.start_offsets(start_pos, rings))
+        yield start_pos, characteristic(machine.permutations(2 * distance), distance)
+
+class Cycle_catalog():
+    """Creates Cycle_catalog object, an on-disk index from characteristic to settings"""
+
+    def __init__(self, path):
+
+        self._path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute("CREATE TABLE IF NOT EXISTS settings (signature TEXT, rotors TEXT, " +
+                         "reflector TEXT, ring_pos TEXT, start_pos TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS wheel_orders (rotors TEXT, reflector TEXT, " +
+                         "ring_pos TEXT, PRIMARY KEY (rotors, reflector, ring_pos))")
+        self._db.execute("CREATE INDEX IF NOT EXISTS by_signature ON settings (signature)")
+        self._db.commit()
+
+    def add(self, key):
+        """Adds every start position of a key's wheel order, reflector and rings. Returns
+        False if they were catalogued before."""
+
+        rotors = " ".join(key["rotors"])
+        rings = " ".join(str(ring) for ring in key.get("ring_pos", [1] * len(key["rotors"])))
+        if self._db.execute("SELECT 1 FROM wheel_orders WHERE rotors = ? AND reflector = ? AND " +
+                            "ring_pos = ?", (rotors, key["reflector"], rings)).fetchone():
+            return False
+
+        rows = ((signature(structures), rotors, key["reflector"], rings, start_pos)
+                for start_pos, structures in characteristics(key))
+        with self._db:
+            self._db.executemany("INSERT INTO settings VALUES (?, ?, ?, ?, ?)", rows)
+            self._db.execute("INSERT INTO wheel_orders VALUES (?, ?, ?)",
+                             (rotors, key["reflector"], rings))
+        return True
+
+    def build(self, rotors = ("I", "II", "III", "IV", "V"), reflectors = ("B",), n_rotors = 3,
+              ring_pos = None, progress = None):
+        """Catalogues every wheel order of n_rotors from rotors, with each reflector"""
+
+        orders = list(itertools.permutations(rotors, n_rotors))
+        for done, (order, reflector) in enumerate(itertools.product(orders, reflectors), 1):
+            key = {"rotors": list(order), "reflector": reflector}
+            if ring_pos != None:
+                key["ring_pos"] = list(ring_pos)
+            self.add(key)
+            if progress != None:
+                progress(done, len(orders) * len(reflectors))
+
+    def lookup(self, structures):
+        """Returns the key dictionaries (without plugboard) whose characteristic matches;
+        structures may be a characteristic or its signature string"""
+
+        text = structures if isinstance(structures, str) else signature(structures)
+        rows = self._db.execute("SELECT rotors, reflector, ring_pos, start_pos FROM settings " +
+                                "WHERE signature = ?", (text,))
+        return [{"rotors": rotors.split(), "reflector": reflector,
+                 "ring_pos": [int(ring) for ring in ring_pos.split()], "start_pos": start_pos}
+                for rotors, reflector, ring_pos, start_pos in rows]
+
+    def counts(self, top = None):
+        """Returns (signature, number of settings) pairs, most common first"""
+
+        query = ("SELECT signature, COUNT(*) AS n FROM settings GROUP BY signature " +
+                 "ORDER BY n DESC" + ("" if top == None else f" LIMIT {int(top)}"))
+        return self._db.execute(query).fetchall()
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM settings").fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+    def __str__(self):
+        signatures = self._db.execute("SELECT COUNT(DISTINCT signature) FROM settings").fetchone()[0]
+        return (f"Cycle catalog {self._path}: {len(self)} settings, {signatures} characteristics")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Enigma cycle structure analysis")
+    parser.add_argument("catalog", help = "SQLite catalog file")
+    parser.add_argument("--build", action = "store_true", help = "catalogue the wheel orders")
+    parser.add_argument("--rotors", nargs = "+", default = ["I", "II", "III", "IV", "V"])
+    parser.add_argument("--reflectors", nargs = "+", default = ["B"])
+    parser.add_argument("--indicators", help = "file of doubled indicators, one per line")
+    parser.add_argument("--signature", help = "characteristic to look up, e.g. 13.13/13.13/13.13")
+    args = parser.parse_args()
+
+    catalog = Cycle_catalog(args.catalog)
+    if args.build:
+        start = time.perf_counter()
+        catalog.build(args.rotors, args.reflectors, progress = lambda done, total:
+                      print(f"\r{done}/{total} wheel orders", end = "", file = sys.stderr, flush = True))
+        print(f"\n{catalog} in {time.perf_counter() - start:.1f} s", file = sys.stderr)
+
+    structures = args.signature
+    if args.indicators:
+        with open(args.indicators) as file:
+            structures = characteristic_from_indicators(line.strip() for line in file if line.strip())
+        if structures == None:
+            parser.error("Not enough indicators to know every letter of AD, BE and CF")
+    if structures != None:
+        print(structures if isinstance(structures, str) else signature(structures))
+        for key in catalog.lookup(structures):
+            print(key)
+    catalog.close()
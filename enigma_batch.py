@@ -0,0 +1,190 @@
+import math
+
+import numpy as np
+
+from enigma import Enigma_machine, Rotor_spindle, Stepper
+
+### Batch encoding of many messages under one key with NumPy. The tables of a
+### Compiled_machine are turned into arrays, and whole batches are encoded with
+### vectorised gathers instead of a Python loop per letter.
+###
+
+class Batch_encoder():
+    """Creates Batch_encoder object which encodes many messages under one key"""
+
+    _max_table_rotors = 4
+
+    def __init__(self, machine):
+
+        if isinstance(machine, Enigma_machine) == False:
+            raise TypeError("Enigma_machine instance only")
+
+        # Ring positions (right to left) are needed to turn start letters into offsets
+        self._rings = [_rotor._ring_pos for _rotor in machine._rotorspindle.args]
+
+        compiled = machine.compile()
+        self._stepper = compiled._stepper
+        self._start = compiled.offsets()
+        self._entry = np.array(compiled._entry, dtype = np.uint8)
+        self._exit = np.array(compiled._exit, dtype = np.uint8)
+        self._forward = [np.array(tables, dtype = np.uint8) for tables in compiled._forward]
+        self._backward = [np.array(tables, dtype = np.uint8) for tables in compiled._backward]
+        self._reflect = np.array(compiled._reflect, dtype = np.uint8)
+        self._next = None
+
+    def _offsets(self, start_pos):
+        """Converts start letters (left to right, e.g. "AAZ") into offsets (right to left)"""
+
+        if start_pos is None:
+            return self._start
+        if (isinstance(start_pos, str) == False or len(start_pos) != len(self._rings)
+                or start_pos.isascii() == False or start_pos.isalpha() == False):
+            raise ValueError(f"Start position must be {len(self._rings)} letters A-Z")
+        # A moving reflector starts each message at its set position
+        return (Rotor_spindle.start_offsets(start_pos, self._rings[::-1])
+                + (0,) * (len(self._start) - len(self._rings)))
+
+    def _slow_index(self, state):
+        """Packs the offsets of all rotors except the right hand rotor into one integer"""
+
+        index = 0
+        for offset in state[:0:-1]:
+            index = index * 26 + offset
+        return index
+
+    def _transitions(self):
+        """Returns the packed state after one keypress for every packed state, or None if
+        there are too many states to tabulate"""
+
+        # The table follows the ratchet stepping of Stepper; other steppers (e.g. the cogs
+        # of Gear_stepper) are stepped with Stepper.runs instead
+        if type(self._stepper) != Stepper:
+            return None
+        if self._next is None and len(self._forward) <= Batch_encoder._max_table_rotors:
+            states = np.arange(26 ** len(self._forward), dtype = np.int64)
+            offsets = [states // 26 ** i % 26 for i in range(len(self._forward))]
+            engaged = [np.array(table, dtype = bool)[offset]
+                       for table, offset in zip(self._stepper._engage, offsets)]
+            self._next = (offsets[0] + 1) % 26
+            for i in range(1, len(offsets)):
+                turns = engaged[i-1] | engaged[i]
+                self._next = self._next + (offsets[i] + turns) % 26 * 26 ** i
+        return self._next
+
+    def _trajectories(self, starts, lengths, width, valid):
+        """Returns the right hand rotor offset and the packed slow state after every
+        keypress of every message, for the valid positions only"""
+
+        # Step every message at once with a table of transitions between packed states.
+        # The first block of columns is stepped one keypress at a time, later blocks jump
+        # a whole block ahead with the transition table raised to the block length.
+        transitions = self._transitions()
+        if transitions is not None:
+            block = max(1, math.isqrt(width))
+            jump = np.arange(len(transitions))
+            power = transitions
+            exponent = block
+            while exponent:
+                if exponent & 1:
+                    jump = power[jump]
+                power = power[power]
+                exponent >>= 1
+
+            state = np.array([self._slow_index(start) * 26 + start[0] for start in starts],
+                             dtype = np.int64)
+            states = np.empty((len(starts), -(-width // block) * block), dtype = np.int64)
+            for column in range(block):
+                state = transitions[state]
+                states[:, column] = state
+            for column in range(block, states.shape[1], block):
+                states[:, column:column + block] = jump[states[:, column - block:column]]
+            states = states[:, :width][valid]
+            return states % 26, states // 26
+
+        # Too many rotors to tabulate: the right hand rotor turns with every keypress, and
+        # the slower rotors are constant within each run of the Stepper
+        right = (np.array([state[0] for state in starts], dtype = np.int64)[:, None] + 1
+                 + np.arange(width)[None, :]) % 26
+        slow_runs = []
+        counts = []
+        for state, length in zip(starts, lengths.tolist()):
+            for first, count in self._stepper.runs(state, length):
+                slow_runs.append(self._slow_index(first))
+                counts.append(count)
+        return right[valid], np.repeat(np.array(slow_runs, dtype = np.int64), counts)
+
+    def _permutations(self, slow):
+        """Returns the substitution for each slow state and right hand rotor offset, shape
+        (len(slow), 26, 26)"""
+
+        # Offsets of the slower rotors, unpacked from the slow index
+        digits = []
+        for _ in range(1, len(self._forward)):
+            digits.append((slow % 26)[:, None])
+            slow = slow // 26
+
+        idx = np.broadcast_to(np.arange(26, dtype = np.uint8), (len(slow), 26))
+        for i, offsets in enumerate(digits, 1):
+            idx = self._forward[i][offsets, idx]
+        idx = self._reflect[idx]
+        for i, offsets in reversed(list(enumerate(digits, 1))):
+            idx = self._backward[i][offsets, idx]
+
+        # Fold in the right hand rotor, entry wheel and plugboard for every offset
+        inner = np.take(idx, self._entry, axis = 1)
+        return self._exit[np.arange(26)[None, :, None], inner]
+
+    def _as_codes(self, messages):
+        """Converts a list of strings into a padded 2-D array of codes 0-25 and lengths"""
+
+        lengths = np.array([len(message) for message in messages], dtype = np.int64)
+        codes = np.zeros((len(messages), max(lengths.max(initial = 0), 1)), dtype = np.uint8)
+        for i, message in enumerate(messages):
+            if isinstance(message, str) == False:
+                raise TypeError("Input a string")
+            if message != "" and (message.isascii() == False or message.isalpha() == False):
+                raise ValueError(f"Inappropriate argument in message {i}")
+            codes[i, :len(message)] = np.frombuffer(message.upper().encode("ascii"),
+                                                    dtype = np.uint8) - 65
+        return codes, lengths
+
+    def encode(self, messages, start_positions = None, lengths = None, as_strings = None):
+        """Encodes a batch of messages, each from its own start position.
+
+        messages may be a list of strings, or a 2-D uint8 array of ASCII letters padded on
+        the right (the length of each row given in lengths). Results are returned as a list
+        of strings for string input, and as a 2-D uint8 array of ASCII letters otherwise.
+        """
+
+        if isinstance(messages, np.ndarray):
+            if messages.ndim != 2:
+                raise ValueError("2-D array required")
+            lengths = (np.full(len(messages), messages.shape[1], dtype = np.int64)
+                       if lengths is None else np.asarray(lengths, dtype = np.int64))
+            codes = messages.astype(np.uint8) - 65
+            valid = np.arange(codes.shape[1])[None, :] < lengths[:, None]
+            if np.any(codes[valid] > 25):
+                raise ValueError("Uppercase ASCII letters only")
+            as_strings = False if as_strings is None else as_strings
+        else:
+            codes, lengths = self._as_codes(messages)
+            valid = np.arange(codes.shape[1])[None, :] < lengths[:, None]
+            as_strings = True if as_strings is None else as_strings
+
+        if start_positions is None:
+            start_positions = [None] * len(codes)
+        if len(start_positions) != len(codes):
+            raise ValueError("One start position per message")
+
+        starts = [self._offsets(start_pos) for start_pos in start_positions]
+        right, slow = self._trajectories(starts, lengths, codes.shape[1], valid)
+
+        # Substitutions are only built for the slow states that actually occur
+        unique, inverse = np.unique(slow, return_inverse = True)
+        permutations = self._permutations(unique)
+        out = np.zeros(codes.shape, dtype = np.uint8)
+        out[valid] = permutations[inverse, right, codes[valid]] + 65
+
+        if as_strings:
+            return [row[:length].tobytes().decode("ascii") for row, length in zip(out, lengths)]
+        return out
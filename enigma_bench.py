@@ -0,0 +1,246 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+from enigma import (Enigma_machine, Permutation_cache, Plugboard, PlugLead, Reflector, Rotor,
+                    Rotor_spindle)
+
+try:
+    from enigma_batch import Batch_encoder
+except ImportError:
+    Batch_encoder = None
+
+### Benchmark suite. Every case is timed as the best of a few runs, each run calling the
+### case enough times to last at least min_time seconds. Results are written as JSON, and
+### can be compared with a stored baseline: a case whose rate falls more than the
+### tolerance below the baseline is a regression, and the exit status is 1.
+###
+### Messages run from 1 to 10^7 letters, but the engines looping over every letter in
+### Python (_slow_engines) and the validation cases are capped at slow_max_length (10^6
+### by default), as one call at 10^7 takes them tens of seconds. The cap is recorded in
+### the report, and the speedups at longer lengths have no reference to compare with.
+###
+
+_key = {"rotors": ["I", "II", "III"], "start_pos": "AAZ", "ring_pos": [1, 1, 1], "reflector": "B",
+        "plugboard": ["HL", "MO", "AJ", "CX", "BZ", "SR", "NI", "YW", "DG", "PK"]}
+
+def _buffer_engine(key):
+    machine = Enigma_machine.from_key(key).compile()
+    return lambda text: machine.encode_into(text.encode("ascii"))
+
+def _trusted_engine(key):
+    machine = Enigma_machine.from_key(key)
+    return lambda text: machine.encode(text, trusted = True)
+
+def _batch_engine(key):
+    encoder = Batch_encoder(Enigma_machine.from_key(key))
+    return lambda text: encoder.encode([text])[0]
+
+# Encoding engines: name -> function building an encode(text) callable for a key. The
+# reference engine is Enigma_machine.encode; faster engines are compared against it.
+# Batch needs NumPy.
+_engines = {"reference": lambda key: Enigma_machine.from_key(key).encode,
+            "cached": lambda key: Enigma_machine.from_key(key, Permutation_cache()).encode,
+            "compiled": lambda key: Enigma_machine.from_key(key).compile().encode,
+            "buffer": _buffer_engine,
+            "trusted": _trusted_engine}
+if Batch_encoder != None:
+    _engines["batch"] = _batch_engine
+
+# Engines that run a Python loop per letter take too long on the longest messages
+_slow_engines = ("reference", "cached", "trusted")
+
+def _check_per_letter(machine, message):
+    """The checks encode used to make: the upfront scan, two plugboard input checks per
+    letter and a rotor index check at every rotor / reflector hop"""
+
+    plugboard = machine._plugboard
+    hops = 2 * len(machine._rotorspindle.args) + 1
+    check_int = machine._reflector._rotor_check_int
+    for letter in message:
+        if letter.upper().isalpha() == False:
+            raise ValueError("Inappropriate argument")
+    for letter in message:
+        plugboard._input_check(letter, 1)
+        plugboard._input_check(letter, 1)
+        for _ in range(hops):
+            check_int(1)
+
+def _measure(func, min_time = 0.2, repeat = 3, budget = 10.0):
+    """Returns the best time of one call to func in seconds, from up to repeat runs of at
+    least min_time seconds each; runs stop early once budget seconds have been spent"""
+
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+
+    best = elapsed / number
+    spent = elapsed
+    for _ in range(repeat - 1):
+        if spent > budget:
+            break
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        spent += elapsed
+        best = min(best, elapsed / number)
+    return best
+
+def cases(max_length = 10 ** 7, slow_max_length = 10 ** 6):
+    """Yields (name, items per call, function) for every benchmark case"""
+
+    rng = random.Random(0)
+    lengths = [10 ** i for i in range(8) if 10 ** i <= max_length]
+    text = "".join(rng.choices(Rotor._alphabet, k = lengths[-1] if lengths else 0))
+
+    for engine, build in _engines.items():
+        encode = build(_key)
+        for length in lengths:
+            if engine in _slow_engines and length > slow_max_length:
+                continue
+            message = text[:length]
+            yield f"encode/{engine}/{length}", length, lambda encode = encode, message = message: encode(message)
+
+    # Validation alone: the per letter checks encode used to make, and the single pass now
+    machine = Enigma_machine.from_key(_key)
+    for length in lengths:
+        if length > slow_max_length:
+            continue
+        message = text[:length]
+        yield f"validate/per_letter/{length}", length, lambda message = message: _check_per_letter(machine, message)
+        yield f"validate/once/{length}", length, lambda message = message: Enigma_machine._validate(message)
+
+    for n_rotors in (3, 4):
+        rotors = [Rotor(name, "A", 1, i >= n_rotors - 2)
+                  for i, name in enumerate(["Beta", "I", "II", "III"][-n_rotors:])]
+        spindle = Rotor_spindle(*rotors)
+        yield f"rotate_spindle/{n_rotors}", 1, spindle.rotate_spindle
+        stepper = spindle.stepper()
+        state = [spindle.offsets()]
+        def step(stepper = stepper, state = state):
+            state[0] = stepper.step(state[0])
+        yield f"stepper/{n_rotors}", 1, step
+
+    leads = [PlugLead(pair) for pair in _key["plugboard"]]
+    def add():
+        plugboard = Plugboard()
+        for lead in leads:
+            plugboard.add(lead)
+    yield "plugboard/add", len(leads), add
+    yield "plugboard/multiple_adds", len(leads), lambda: Plugboard().multiple_adds(*_key["plugboard"])
+
+    def construct():
+        plugboard = Plugboard()
+        plugboard.multiple_adds(*_key["plugboard"])
+        spindle = Rotor_spindle(Rotor("I", "A", 1, False), Rotor("II", "A", 1), Rotor("III", "Z", 1))
+        return Enigma_machine(spindle, Reflector("B"), plugboard)
+    yield "construct/Enigma_machine", 1, construct
+    yield "construct/from_key", 1, lambda: Enigma_machine.from_key(_key)
+    machine = Enigma_machine.from_key(_key)
+    yield "construct/compile", 1, machine.compile
+
+def run(max_length = 10 ** 7, slow_max_length = 10 ** 6, min_time = 0.2, repeat = 3,
+        select = None, progress = None):
+    """Runs the cases whose name contains select (all if None), returning a JSON-ready
+    dictionary of results"""
+
+    results = {}
+    for name, items, func in cases(max_length, slow_max_length):
+        if select != None and select not in name:
+            continue
+        seconds = _measure(func, min_time, repeat)
+        results[name] = {"seconds": seconds, "items": items, "rate": items / seconds}
+        if progress != None:
+            progress(name, results[name])
+
+    # Speed of every engine relative to the reference, at the lengths both were run
+    speedups = {}
+    for name, result in results.items():
+        parts = name.split("/")
+        reference = "/".join([parts[0], "reference", parts[-1]])
+        if parts[0] == "encode" and parts[1] != "reference" and reference in results:
+            speedups[name] = result["rate"] / results[reference]["rate"]
+
+    # Share of the encode time spent validating, with the old per letter checks and with the
+    # single pass, taking the trusted (unchecked) encode as the time of the rest
+    validation = {}
+    for name, result in results.items():
+        parts = name.split("/")
+        trusted = f"encode/trusted/{parts[-1]}"
+        if parts[0] == "validate" and trusted in results:
+            seconds = result["seconds"]
+            validation[name] = seconds / (seconds + results[trusted]["seconds"])
+
+    return {"python": platform.python_version(), "implementation": platform.python_implementation(),
+            "machine": platform.machine(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "max_length": max_length,
+            "capped": {"engines": list(_slow_engines), "max_length": min(max_length, slow_max_length)},
+            "results": results, "speedups": speedups, "validation_share": validation}
+
+def compare(report, baseline, tolerance = 0.25):
+    """Returns a list of regressions: cases whose rate is more than tolerance (a fraction)
+    below the rate in the baseline report. Cases missing from either are ignored."""
+
+    regressions = []
+    for name, result in report["results"].items():
+        if name in baseline["results"]:
+            before = baseline["results"][name]["rate"]
+            if result["rate"] < before * (1 - tolerance):
+                regressions.append(f"{name}: {result['rate']:.4g}/s, baseline {before:.4g}/s " +
+                                   f"({result['rate'] / before - 1:+.0%})")
+    return regressions
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Enigma benchmark suite")
+    parser.add_argument("-o", "--output", help = "write the JSON report to this file")
+    parser.add_argument("--baseline", help = "JSON report to check for regressions against")
+    parser.add_argument("--save-baseline", help = "also write the report to this file")
+    parser.add_argument("--tolerance", type = float, default = 0.25,
+                        help = "allowed slowdown against the baseline, as a fraction")
+    parser.add_argument("--max-length", type = int, default = 10 ** 7)
+    parser.add_argument("--slow-max-length", type = int, default = 10 ** 6,
+                        help = "longest message for the reference, cached and trusted engines")
+    parser.add_argument("--min-time", type = float, default = 0.2)
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--select", help = "only run cases whose name contains this")
+    parser.add_argument("--quick", action = "store_true", help = "messages up to 10^4 letters")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.max_length = min(args.max_length, 10 ** 4)
+    if args.max_length > args.slow_max_length:
+        print(f"Engines {', '.join(_slow_engines)} and the validation cases are capped at " +
+              f"{args.slow_max_length} letters (--slow-max-length)", file = sys.stderr)
+
+    report = run(args.max_length, args.slow_max_length, args.min_time, args.repeat, args.select,
+                 progress = lambda name, result: print(f"{name:32} {result['seconds'] * 1e6:12.2f} us" +
+                                                       f" {result['rate']:14.1f} /s", file = sys.stderr))
+    output = json.dumps(report, indent = 2)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as file:
+                file.write(output + "\n")
+    if args.output == None:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file = sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
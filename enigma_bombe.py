@@ -0,0 +1,305 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import signal
+import threading
+
+import numpy as np
+
+from enigma import Enigma_machine, Rotor, Rotor_spindle, Wiring_registry
+from enigma_batch import Batch_encoder
+from enigma_tables import Table_cache
+
+### Turing-Welchman bombe. The crib and the ciphertext under it make a 'menu': a graph on
+### the letters with an edge p - c for every crib letter p enciphered as c at keypress i.
+### As the plugboard P swaps letters in pairs, P(c) = S_i(P(p)) where S_i is the
+### substitution of the rotors and reflector alone at keypress i. A hypothesis P(t) = x
+### for the test letter t therefore implies hypotheses for every letter joined to t, and
+### so on round the loops of the menu (with P(a) = b also implying P(b) = a: the
+### 'diagonal board'). Every rotor position of a wheel order is tested at once: the
+### hypotheses are a (26, positions, 26) boolean array, and each edge is applied to all
+### positions with one gather through the substitutions of that keypress. A position
+### whose closure lights every hypothesis for the test letter is impossible; the others
+### are stops. Each stop is then checked with all 26 hypotheses for the test letter, and
+### a hypothesis survives if its closure gives every letter at most one partner; the
+### partners found are the plugboard pairs it implies.
+###
+### Without ring settings the middle and left rotors are assumed not to turn under the
+### crib, as on the bombe itself: the substitutions depend on the rotor cores alone, so
+### ring settings are not searched and stops are reported with rings at 1. With ring
+### settings the exact stepping of each ring setting is followed instead.
+###
+
+# Wheel order tables built by each worker process
+_worker = {}
+
+def menu(ciphertext, crib, crib_pos = 0):
+    """Returns the menu edges (crib code, cipher code, keypress from the crib start) of a
+    crib lying at crib_pos in the ciphertext"""
+
+    edges = []
+    for i, (cipher, plain) in enumerate(zip(ciphertext[crib_pos:crib_pos + len(crib)].upper(),
+                                            crib.upper())):
+        if cipher == plain:
+            raise ValueError(f"Crib letter {i} is its own encipherment; no letter encodes to itself")
+        edges.append((ord(plain) - 65, ord(cipher) - 65, i))
+    return edges
+
+def test_letter(edges):
+    """Returns the letter code with the most menu edges"""
+
+    degree = [0] * 26
+    for plain, cipher, _ in edges:
+        degree[plain] += 1
+        degree[cipher] += 1
+    return degree.index(max(degree))
+
+def closure(lit, scramblers, edges, test = None):
+    """Lights every hypothesis implied by those already lit, in place. lit is a boolean
+    array (26, positions, 26): lit[a, n, b] is the hypothesis P(a) = b at position n.
+    scramblers holds the substitutions (positions, keypresses, 26). With a test letter,
+    positions are dropped as soon as every hypothesis for it is lit. Returns the
+    positions not dropped."""
+
+    active = np.arange(lit.shape[1])
+    work = lit
+    while len(active):
+        # Flat indices into the rows of one letter (positions x 26), for every keypress
+        index = (scramblers[active].transpose(1, 0, 2)
+                 + (np.arange(len(active), dtype = np.intp) * 26)[None, :, None])
+        while True:
+            before = np.count_nonzero(work)
+            for plain, cipher, i in edges:
+                work[cipher] |= np.take(work[plain], index[i])
+                work[plain] |= np.take(work[cipher], index[i])
+            work |= work.transpose(2, 1, 0)
+            changed = np.count_nonzero(work) != before
+            if changed == False or test != None and work[test].all(axis = 1).any():
+                break
+        lit[:, active] = work
+        if changed == False:
+            break
+
+        keep = work[test].all(axis = 1) == False
+        active = active[keep]
+        work = work[:, keep]
+    return active
+
+def _pairs(lit):
+    """Returns the plugboard pairs of a consistent closure (26, 26), e.g. ['AB', 'CX']"""
+
+    return ["".join(chr(code + 65) for code in pair)
+            for pair in zip(*np.nonzero(np.triu(lit, 1)))]
+
+def _init_worker(edges, crib_pos, rotors, reflectors, ring_settings, table_cache = None,
+                 chunk_size = 1 << 14):
+    # Ctrl-C is handled by the parent, which stops the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker.clear()
+    _worker.update(edges = edges, crib_pos = crib_pos, ring_settings = ring_settings,
+                   registry = Wiring_registry(rotors, reflectors, frozen = True),
+                   table_cache = None if table_cache == None else Table_cache(table_cache),
+                   chunk_size = chunk_size)
+
+def _table(order, reflector):
+    """Returns the substitutions (without plugboard) of every rotor position of a wheel
+    order, shape (26 ** n_rotors, 26); row = offsets right to left as base 26 digits"""
+
+    machine = Enigma_machine.from_key({"rotors": list(order), "reflector": reflector},
+                                      registry = _worker["registry"])
+    if _worker["table_cache"] != None:
+        return np.frombuffer(_worker["table_cache"].table(machine), dtype = np.uint8).reshape(-1, 26)
+    encoder = Batch_encoder(machine)
+    slow = np.arange(26 ** (len(order) - 1), dtype = np.int64)
+    return encoder._permutations(slow).reshape(-1, 26)
+
+def _advance(transitions, states, keypresses):
+    """Returns the packed states reached after a number of keypresses"""
+
+    power = transitions
+    while keypresses:
+        if keypresses & 1:
+            states = power[states]
+        power = power[power]
+        keypresses >>= 1
+    return states
+
+def _states(starts, keypresses, transitions = None):
+    """Returns the packed states (rows of the table) at each keypress of the crib for
+    every packed start state, shape (len(starts), keypresses)"""
+
+    if transitions is None:
+        # Only the right hand rotor turns: the lowest digit counts up, the rest is kept
+        steps = np.arange(_worker["crib_pos"] + 1, _worker["crib_pos"] + 1 + keypresses)
+        return starts[:, None] - starts[:, None] % 26 + (starts[:, None] + steps[None, :]) % 26
+
+    states = np.empty((len(starts), keypresses), dtype = np.int64)
+    state = _advance(transitions, starts, _worker["crib_pos"])
+    for i in range(keypresses):
+        state = transitions[state]
+        states[:, i] = state
+    return states
+
+def _start_pos(start, rings):
+    """Start letters (left to right) of a packed start state and ring setting"""
+
+    return Rotor_spindle.start_letters([start // 26 ** i % 26 for i in range(len(rings))], rings)
+
+def _bombe_task(task):
+    """Runs the bombe over every rotor position of one (wheel order, reflector)"""
+
+    order, reflector = task
+    edges = _worker["edges"]
+    test = test_letter(edges)
+    keypresses = max(i for _, _, i in edges) + 1
+    table = _table(order, reflector)
+    n_positions = 26 ** len(order)
+
+    stops = []
+    for rings in _worker["ring_settings"] or [(1,) * len(order)]:
+        transitions = None
+        if _worker["ring_settings"] != None:
+            machine = Enigma_machine.from_key({"rotors": list(order), "reflector": reflector,
+                                               "ring_pos": list(rings)}, registry = _worker["registry"])
+            transitions = Batch_encoder(machine)._transitions()
+            if transitions is None:
+                raise ValueError("Exact stepping needs a ratchet stepped machine of at most " +
+                                 f"{Batch_encoder._max_table_rotors} rotors")
+
+        for first in range(0, n_positions, _worker["chunk_size"]):
+            starts = np.arange(first, min(first + _worker["chunk_size"], n_positions), dtype = np.int64)
+            scramblers = table[_states(starts, keypresses, transitions)]
+
+            # One hypothesis for the test letter; a position is a stop unless it lights all
+            lit = np.zeros((26, len(starts), 26), dtype = bool)
+            lit[test, :, test] = True
+            found = closure(lit, scramblers, edges, test)
+            if len(found) == 0:
+                continue
+
+            # Check every hypothesis for the test letter at each stop
+            lit = np.zeros((26, len(found), 26, 26), dtype = bool)
+            lit[test, :, np.arange(26), np.arange(26)] = True
+            lit = lit.reshape(26, -1, 26)
+            closure(lit, np.repeat(scramblers[found], 26, axis = 0), edges)
+            consistent = (lit.sum(axis = 2) <= 1).all(axis = 0)
+            for idx in np.nonzero(consistent)[0]:
+                stops.append({"rotors": list(order), "reflector": reflector, "ring_pos": list(rings),
+                              "start_pos": _start_pos(int(starts[found[idx // 26]]), rings),
+                              "plugboard": _pairs(lit[:, idx])})
+
+    return task, stops
+
+class Bombe():
+    """Creates Bombe object which finds the rotor positions and plugboard pairs consistent
+    with a crib, for every wheel order at once"""
+
+    def __init__(self, ciphertext, crib, crib_pos = 0, rotors = ("I", "II", "III", "IV", "V"),
+                 reflectors = ("B",), n_rotors = 3, ring_settings = None, processes = None,
+                 registry = None, table_cache = None):
+
+        for text in (ciphertext, crib):
+            if isinstance(text, str) == False or text.isascii() == False or text.isalpha() == False:
+                raise ValueError("Ciphertext and crib must be letters A-Z")
+        if crib_pos < 0 or crib_pos + len(crib) > len(ciphertext):
+            raise ValueError("Crib must lie within the ciphertext")
+        if n_rotors > Batch_encoder._max_table_rotors:
+            raise ValueError(f"The bombe takes at most {Batch_encoder._max_table_rotors} rotors")
+        registry = Rotor._registry if registry == None else registry
+        for name in rotors:
+            if name not in registry.rotor_names():
+                raise ValueError(f"Unknown rotor {name}")
+        for name in reflectors:
+            if name not in registry.reflector_names():
+                raise ValueError(f"Unknown reflector {name}")
+
+        self._edges = menu(ciphertext, crib, crib_pos)
+        self._crib_pos = crib_pos
+        self._rotors = list(rotors)
+        self._reflectors = list(reflectors)
+        self._n_rotors = n_rotors
+        self._ring_settings = None if ring_settings == None else [tuple(rings) for rings in ring_settings]
+        self._processes = processes
+        self._registry = registry
+        self._table_cache = table_cache
+        self._cancel = threading.Event()
+
+    def menu(self):
+        """Returns the menu edges (crib code, cipher code, keypress) and the test letter"""
+
+        return self._edges, chr(test_letter(self._edges) + 65)
+
+    def tasks(self):
+        """Returns the list of (wheel order, reflector) tasks"""
+
+        return [(order, reflector)
+                for order in itertools.permutations(self._rotors, self._n_rotors)
+                for reflector in self._reflectors]
+
+    def cancel(self):
+        """Stops a running bombe after the current task"""
+
+        self._cancel.set()
+
+    def run(self, progress = None):
+        """Runs the bombe, returning the surviving stops as key dictionaries with the
+        plugboard pairs they imply (letters off the menu are not known).
+
+        progress(done, total, stops) is called after every finished task. Ctrl-C stops the
+        bombe like cancel(), returning the stops found so far.
+        """
+
+        self._cancel.clear()
+        tasks = self.tasks()
+        initargs = (self._edges, self._crib_pos,
+                    [self._registry.rotor(name) for name in self._rotors],
+                    [self._registry.reflector(name) for name in self._reflectors],
+                    self._ring_settings, self._table_cache)
+
+        stops = []
+        try:
+            with multiprocessing.Pool(self._processes, _init_worker, initargs) as pool:
+                for done, (_, found) in enumerate(pool.imap_unordered(_bombe_task, tasks), 1):
+                    stops.extend(found)
+                    if progress != None:
+                        progress(done, len(tasks), stops)
+                    if self._cancel.is_set():
+                        break
+        except KeyboardInterrupt:
+            self._cancel.set()
+        return stops
+
+    def __str__(self):
+        edges, test = self.menu()
+        return (f"Bombe: menu of {len(edges)} edges, test letter {test}, {len(self.tasks())} wheel orders")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Turing-Welchman bombe for a ciphertext and crib")
+    parser.add_argument("ciphertext")
+    parser.add_argument("crib")
+    parser.add_argument("--crib-pos", type = int, default = 0)
+    parser.add_argument("--rotors", nargs = "+", default = ["I", "II", "III", "IV", "V"])
+    parser.add_argument("--reflectors", nargs = "+", default = ["B"])
+    parser.add_argument("--n-rotors", type = int, default = 3)
+    parser.add_argument("--rings", nargs = "+", type = int,
+                        help = "ring setting (left to right) to follow the exact stepping of")
+    parser.add_argument("--processes", type = int)
+    parser.add_argument("--table-cache", help = "directory of memory-mapped substitution tables")
+    args = parser.parse_args()
+
+    try:
+        bombe = Bombe(args.ciphertext, args.crib, args.crib_pos, args.rotors, args.reflectors,
+                      args.n_rotors, None if args.rings == None else [args.rings],
+                      args.processes, table_cache = args.table_cache)
+    except ValueError as error:
+        parser.error(str(error))
+    print(bombe)
+
+    def report(done, total, stops):
+        print(f"\r{done}/{total} wheel orders, {len(stops)} stops", end = "", flush = True)
+
+    stops = bombe.run(report)
+    print("")
+    for key in stops:
+        print(json.dumps(key))
@@ -0,0 +1,152 @@
+import argparse
+import json
+import mmap
+import multiprocessing
+import os
+import sys
+import time
+
+from enigma import Enigma_machine, Enigma_stream
+
+### Command line bulk encoder. Input files are memory-mapped and cut into segments.
+### Every segment is encoded independently: the number of letters before it gives the
+### keypresses needed to reach it, and the compiled machine seeks straight to that rotor
+### position. Segments are spread over a process pool and written into the output file
+### at their own offsets.
+###
+
+_letters = bytes(range(65, 91)) + bytes(range(97, 123))
+_not_letters = bytes(i for i in range(256) if i not in _letters)
+
+# Segments are read and written in blocks of this size to keep memory bounded
+_block_size = 1 << 22
+
+# Files are split between the processes, but not into segments smaller than this
+_min_segment = 1 << 16
+
+def parse_key(args):
+    """Returns a key dictionary (see Enigma_machine.from_key) from the parsed arguments"""
+
+    if args.key:
+        with open(args.key) as file:
+            key = json.load(file)
+    elif args.rotors == None or args.reflector == None:
+        raise ValueError("Give --key, or --rotors and --reflector")
+    else:
+        key = {"rotors": args.rotors, "reflector": args.reflector,
+               "start_pos": args.start or "A" * len(args.rotors),
+               "ring_pos": args.rings or [1] * len(args.rotors),
+               "plugboard": args.plugboard or [], "etw": args.etw}
+
+    # The key is built once here, so a bad one is reported before any worker starts
+    try:
+        Enigma_machine.from_key(key)
+    except (KeyError, ValueError, TypeError) as error:
+        raise ValueError(f"Bad key: {error}")
+    return key
+
+def _count_segment(task):
+    """Returns the number of letters in one segment of a file"""
+
+    path, start, stop = task
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as data:
+        count = 0
+        for block in range(start, stop, _block_size):
+            count += len(data[block:min(block + _block_size, stop)].translate(None, _not_letters))
+    return count
+
+def _encode_segment(task):
+    """Encodes one segment of a file into the output file, from a precomputed start state"""
+
+    path, out_path, start, stop, out_offset, key, keypresses, non_alpha = task
+    machine = Enigma_machine.from_key(key).compile()
+    machine.seek(keypresses)
+    stream = Enigma_stream(machine, non_alpha)
+
+    # The output of a segment is contiguous, so each worker seeks its own handle once
+    # (os.pwrite is not available on Windows)
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as data:
+        with open(out_path, "r+b") as out:
+            out.seek(out_offset)
+            for block in range(start, stop, _block_size):
+                out.write(stream.encode(data[block:min(block + _block_size, stop)]))
+
+def encode_file(path, out_path, key, processes = None, non_alpha = "pass", pool = None):
+    """Encodes a file into out_path, returning the number of bytes read"""
+
+    # The output is truncated before the input is read, so they can't be the same file
+    if os.path.exists(out_path) and os.path.samefile(path, out_path):
+        raise ValueError(f"{out_path} is the input file")
+
+    size = os.path.getsize(path)
+    processes = processes or os.cpu_count() or 1
+    segments = max(1, min(processes * 4, size // _min_segment))
+    bounds = [size * i // segments for i in range(segments + 1)]
+    tasks = [(path, start, stop) for start, stop in zip(bounds, bounds[1:]) if stop > start]
+
+    mapper = map if pool == None else pool.map
+    counts = list(mapper(_count_segment, tasks)) if size else []
+    if non_alpha == "error" and sum(counts) != size:
+        raise ValueError(f"{path} contains characters other than letters A-Z")
+
+    # Keypresses before each segment, and where its output starts
+    jobs = []
+    keypresses = 0
+    out_offset = 0
+    for (_, start, stop), count in zip(tasks, counts):
+        jobs.append((path, out_path, start, stop, out_offset, key, keypresses, non_alpha))
+        keypresses += count
+        out_offset += count if non_alpha == "strip" else stop - start
+
+    with open(out_path, "wb") as file:
+        file.truncate(out_offset)
+    list(mapper(_encode_segment, jobs))
+    return size
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Encode files with an Enigma machine")
+    parser.add_argument("inputs", nargs = "+", help = "files to encode")
+    parser.add_argument("-o", "--output", help = "output file (one input) or directory")
+    parser.add_argument("--key", help = "JSON file holding a key dictionary")
+    parser.add_argument("--rotors", nargs = "+", help = "rotor names, left to right")
+    parser.add_argument("--start", help = "start positions, left to right, e.g. AAZ")
+    parser.add_argument("--rings", nargs = "+", type = int, help = "ring positions 1-26")
+    parser.add_argument("--reflector")
+    parser.add_argument("--plugboard", nargs = "*", help = "letter pairs, e.g. HL MO")
+    parser.add_argument("--etw", help = "entry wheel mapping")
+    parser.add_argument("--non-alpha", choices = Enigma_stream._policies, default = "pass")
+    parser.add_argument("--processes", type = int, default = os.cpu_count())
+    args = parser.parse_args(argv)
+
+    try:
+        key = parse_key(args)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+
+    if len(args.inputs) > 1 and args.output and os.path.isdir(args.output) == False:
+        parser.error("--output must be a directory when encoding several files")
+
+    outputs = []
+    for path in args.inputs:
+        if args.output == None:
+            out_path = path + ".enigma"
+        elif os.path.isdir(args.output):
+            out_path = os.path.join(args.output, os.path.basename(path))
+        else:
+            out_path = args.output
+        if os.path.exists(out_path) and os.path.samefile(path, out_path):
+            parser.error(f"{out_path} is the input file {path}")
+        outputs.append(out_path)
+
+    total = 0
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.processes) as pool:
+        for path, out_path in zip(args.inputs, outputs):
+            total += encode_file(path, out_path, key, args.processes, args.non_alpha, pool)
+    elapsed = time.perf_counter() - start
+
+    print(f"Encoded {len(args.inputs)} file(s), {total / 1e6:.1f} MB in {elapsed:.2f} s, " +
+          f"{total / 1e6 / max(elapsed, 1e-9):.2f} MB/s", file = sys.stderr)
+
+if __name__ == "__main__":
+    main()
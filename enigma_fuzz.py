@@ -0,0 +1,330 @@
+import argparse
+from array import array
+import io
+import json
+import random
+import sys
+import time
+
+from enigma import (Enigma_machine, Enigma_stream, Encode_metrics, Machine_model, Permutation_cache,
+                    Random_access, Rotor, Wheel)
+from enigma_packed import encode_packed, read_packed, unpack, write_packed
+
+try:
+    from enigma_batch import Batch_encoder
+except ImportError:
+    Batch_encoder = None
+
+### Differential fuzz harness. Random keys (built in and custom multi-notch wheels, 1 to 5
+### rotors, rings, entry wheels, plugboards and every Machine_model) and random messages
+### are encoded by every engine, and each result must equal Enigma_machine.encode letter
+### for letter. Messages are chosen to cross turnovers and double steps, and the streaming
+### and random access engines are fed the message in random pieces. Each engine's encode
+### time is summed over the same cases, so the speedup over the reference is measured in
+### the same run. Case n of a seed is always the same key and message, and a mismatch is
+### cut down to the shortest prefix that still differs, so failures are reproducible.
+###
+
+_alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+# Engines: name -> function building an encode(text) callable for a machine built by
+# build(); rng is for engines that cut the message into random pieces. The reference
+# engine is Enigma_machine.encode.
+def _reference_engine(build, rng):
+    return build().encode
+
+def _cached_engine(build, rng):
+    return build(Permutation_cache()).encode
+
+def _trusted_engine(build, rng):
+    machine = build()
+    return lambda text: machine.encode(text, trusted = True)
+
+def _instrumented_engine(build, rng):
+    machine = build()
+    machine.instrument(Encode_metrics())
+    return machine.encode
+
+def _compiled_engine(build, rng):
+    return build().compile().encode
+
+def _buffer_engine(build, rng):
+    machine = build().compile()
+    return lambda text: machine.encode_into(text.lower().encode("ascii")).decode("ascii")
+
+def _machine_buffer_engine(build, rng):
+    machine = build()
+    def encode(text):
+        middle = rng.randint(0, len(text))
+        return (machine.encode_into(text[:middle].encode("ascii")) +
+                machine.encode_into(text[middle:].encode("ascii"))).decode("ascii")
+    return encode
+
+def _cuts(rng, length, pieces):
+    return sorted(rng.randint(0, length) for _ in range(pieces))
+
+def _stream_engine(build, rng):
+    stream = Enigma_stream(build())
+    def encode(text):
+        bounds = [0] + _cuts(rng, len(text), rng.randint(0, 8)) + [len(text)]
+        return "".join(stream.encode(text[start:stop]) for start, stop in zip(bounds, bounds[1:]))
+    return encode
+
+def _seek_engine(build, rng):
+    machine = build()
+    first = machine.compile()
+    second = machine.compile()
+    def encode(text):
+        middle = rng.randint(0, len(text))
+        second.seek(middle)
+        return first.encode(text[:middle], trusted = True) + second.encode(text[middle:], trusted = True)
+    return encode
+
+def _random_access_engine(build, rng):
+    access = Random_access(build(), interval = rng.choice([1, 7, 26, 100, 1 << 16]))
+    def encode(text):
+        bounds = [0] + _cuts(rng, len(text), rng.randint(1, 8)) + [len(text)]
+        pieces = list(zip(bounds, bounds[1:]))
+        decoded = [None] * len(pieces)
+        for idx in rng.sample(range(len(pieces)), len(pieces)):
+            decoded[idx] = access.decode_range(text, *pieces[idx])
+        return "".join(decoded)
+    return encode
+
+def _packed_engine(build, rng):
+    machine = build()
+    def encode(text):
+        source = io.BytesIO()
+        write_packed(source, text.encode("ascii"))
+        source.seek(0)
+        destination = io.BytesIO()
+        encode_packed(machine, source, destination, chunk_size = rng.choice([8, 64, 1 << 20]))
+        destination.seek(0)
+        return read_packed(destination).decode("ascii")
+    return encode
+
+def _batch_engine(build, rng):
+    encoder = Batch_encoder(build())
+    return lambda text: encoder.encode([text])[0]
+
+_engines = {"reference": _reference_engine, "cached": _cached_engine, "trusted": _trusted_engine,
+            "instrumented": _instrumented_engine, "compiled": _compiled_engine,
+            "buffer": _buffer_engine, "machine_buffer": _machine_buffer_engine,
+            "stream": _stream_engine, "seek": _seek_engine, "random_access": _random_access_engine,
+            "packed": _packed_engine}
+
+if Batch_encoder != None:
+    _engines["batch"] = _batch_engine
+
+def _random_wiring(rng):
+    return "".join(rng.sample(_alphabet, 26))
+
+def _random_reflector(rng):
+    """Returns a random reflector mapping: 13 swaps, no letter wired to itself"""
+
+    letters = rng.sample(range(26), 26)
+    mapping = [0] * 26
+    for a, b in zip(letters[0::2], letters[1::2]):
+        mapping[a], mapping[b] = b, a
+    return "".join(_alphabet[idx] for idx in mapping)
+
+def random_case(rng):
+    """Returns (key, custom wheels) for a random machine. Custom wheels are (kind, name,
+    mapping, notches) and are added to a session registry when the machine is built."""
+
+    custom = []
+    kind = rng.random()
+    if kind < 0.3:
+        model = Machine_model.get(rng.choice(Machine_model.names()))
+        rotors = [rng.choice(names) for names in model.positions]
+        key = {"model": model.name, "rotors": rotors, "reflector": rng.choice(model.reflectors)}
+        if model.settable_reflector:
+            key["reflector_pos"] = rng.choice(_alphabet)
+        plugboard = model.plugboard
+    else:
+        n_rotors = rng.choice([1, 2, 3, 3, 3, 4, 4, 5])
+        names = Rotor._registry.rotor_names()
+        rotors = []
+        for i in range(n_rotors):
+            if rng.random() < 0.3:
+                # Custom wheels with none, one or several notches
+                notch = rng.sample(_alphabet, rng.choice([0, 1, 2, 3, 5])) or [None]
+                custom.append(("rotor", f"Fuzz{i}", _random_wiring(rng), notch))
+                rotors.append(f"Fuzz{i}")
+            else:
+                rotors.append(rng.choice(names))
+        if rng.random() < 0.2:
+            custom.append(("reflector", "FuzzUKW", _random_reflector(rng), [None]))
+            reflector = "FuzzUKW"
+        else:
+            reflector = rng.choice(Rotor._registry.reflector_names())
+        key = {"rotors": rotors, "reflector": reflector}
+        if rng.random() < 0.3:
+            key["etw"] = _random_wiring(rng)
+        plugboard = True
+
+    key["start_pos"] = "".join(rng.choices(_alphabet, k = len(key["rotors"])))
+    key["ring_pos"] = [rng.randint(1, 26) for _ in key["rotors"]]
+    if plugboard:
+        letters = rng.sample(_alphabet, 2 * rng.randint(0, 10))
+        key["plugboard"] = [a + b for a, b in zip(letters[0::2], letters[1::2])]
+    return key, custom
+
+def random_message(rng, max_length):
+    """Returns a random message of letters; lengths are skewed short, with some long enough
+    to turn the middle rotors (and double step) several times"""
+
+    length = min(max_length, rng.choice([1, 2, 25, 26, 27, rng.randint(1, 700), rng.randint(1, max_length)]))
+    return "".join(rng.choices(_alphabet, k = length))
+
+def builder(key, custom):
+    """Returns build(cache = None), making a new machine of a key with its custom wheels"""
+
+    registry = None
+    if custom:
+        registry = Rotor._registry.session()
+        for kind, name, mapping, notch in custom:
+            getattr(registry, f"add_{kind}")(Wheel(name, mapping, notch))
+    return lambda cache = None: Enigma_machine.from_key(key, cache, registry)
+
+# Buffers every buffer entry point must refuse: control bytes are not letters, even though
+# 0x00-0x19 look like codes once letters are turned into codes
+_invalid_buffers = (b"AB\nC\x00", b"A\x19B", b"HELLO WORLD", b"A\xc1")
+
+def _instrumented_buffer(data):
+    machine = Enigma_machine.from_key({"rotors": ["I", "II", "III"], "reflector": "B"})
+    machine.instrument(Encode_metrics())
+    return machine.encode_into(data)
+
+# Buffers of items wider than a byte; read byte by byte their zero high bytes look like "A"
+_wide_buffers = (array("H", [1, 2, 3]), array("q", [0, 1, 2]))
+
+# Buffer entry points: name -> function encoding (or storing) a buffer of ASCII letters
+_buffer_entries = {
+    "compiled.encode_into": lambda data: Enigma_machine.from_key(
+        {"rotors": ["I", "II", "III"], "reflector": "B"}).compile().encode_into(data),
+    "machine.encode_into": lambda data: Enigma_machine.from_key(
+        {"rotors": ["I", "II", "III"], "reflector": "B"}).encode_into(data),
+    "instrumented.encode_into": _instrumented_buffer,
+    "write_packed": lambda data: write_packed(io.BytesIO(), data)}
+
+# Entry points given a buffer of codes, or a second (output) buffer
+_code_entries = {
+    "compiled.encode_into/codes": lambda data: Enigma_machine.from_key(
+        {"rotors": ["I", "II", "III"], "reflector": "B"}).compile().encode_into(data, codes = True),
+    "compiled.encode_into/out": lambda data: Enigma_machine.from_key(
+        {"rotors": ["I", "II", "III"], "reflector": "B"}).compile().encode_into(b"ABCDEF", data),
+    "machine.encode_into/codes": lambda data: Enigma_machine.from_key(
+        {"rotors": ["I", "II", "III"], "reflector": "B"}).encode_into(data, codes = True),
+    "write_packed/codes": lambda data: write_packed(io.BytesIO(), data, codes = True),
+    "unpack": lambda data: unpack(data)}
+
+def check_rejects():
+    """Returns a failure for every buffer entry point that accepts a buffer holding
+    anything but ASCII letters, or a buffer of items wider than a byte"""
+
+    failures = []
+    for name, entry in _buffer_entries.items():
+        for data in _invalid_buffers:
+            try:
+                result = entry(data)
+            except ValueError:
+                continue
+            except Exception as error:
+                result = f"{type(error).__name__}: {error}"
+            failures.append({"engine": f"rejects/{name}", "message": data.decode("latin-1"),
+                             "expected": "ValueError", "got": repr(result)})
+    for name, entry in {**_buffer_entries, **_code_entries}.items():
+        for data in _wide_buffers:
+            try:
+                result = entry(data)
+            except TypeError:
+                continue
+            except Exception as error:
+                result = f"{type(error).__name__}: {error}"
+            failures.append({"engine": f"rejects/{name}", "message": repr(data),
+                             "expected": "TypeError", "got": repr(result)})
+    return failures
+
+def _first_difference(expected, got):
+    for idx, (a, b) in enumerate(zip(expected, got)):
+        if a != b:
+            return idx
+    return min(len(expected), len(got))
+
+def run(cases = 200, seed = 0, max_length = 2000, engines = None, progress = None):
+    """Encodes cases random keys and messages with every engine (or those named in engines),
+    returning a JSON-ready report of failures and each engine's time against the reference"""
+
+    names = [name for name in _engines if engines == None or name == "reference" or name in engines]
+    totals = {name: {"cases": 0, "failures": 0, "seconds": 0.0, "letters": 0} for name in names}
+    failures = check_rejects()
+
+    for case in range(cases):
+        rng = random.Random(f"{seed}/{case}")
+        key, custom = random_case(rng)
+        message = random_message(rng, max_length)
+        build = builder(key, custom)
+
+        expected = None
+        for name in names:
+            engine_rng = random.Random(f"{seed}/{case}/{name}")
+            try:
+                encode = _engines[name](build, engine_rng)
+                start = time.perf_counter()
+                got = encode(message)
+                seconds = time.perf_counter() - start
+            except Exception as error:
+                got = f"{type(error).__name__}: {error}"
+                seconds = 0.0
+
+            if name == "reference":
+                expected = got
+            totals[name]["cases"] += 1
+            totals[name]["seconds"] += seconds
+            totals[name]["letters"] += len(message)
+            if got != expected:
+                # The shortest prefix that still differs: encoding is prefix consistent
+                idx = _first_difference(expected, got)
+                totals[name]["failures"] += 1
+                failures.append({"engine": name, "seed": seed, "case": case, "key": key,
+                                 "custom": custom, "message": message[:idx + 1],
+                                 "expected": expected[:idx + 1], "got": got[:idx + 1]
+                                 if got.isalpha() else got})
+        if progress != None:
+            progress(case + 1, cases, len(failures))
+
+    reference = totals["reference"]["seconds"]
+    for name, total in totals.items():
+        total["speedup"] = reference / total["seconds"] if total["seconds"] else None
+    return {"seed": seed, "cases": cases, "max_length": max_length,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "engines": totals, "failures": failures}
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Differential fuzzing of the Enigma engines")
+    parser.add_argument("--cases", type = int, default = 200)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--max-length", type = int, default = 2000)
+    parser.add_argument("--engines", nargs = "+", choices = list(_engines),
+                        help = "engines to check against the reference (default all)")
+    parser.add_argument("-o", "--output", help = "write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    report = run(args.cases, args.seed, args.max_length, args.engines,
+                 progress = lambda done, total, failures:
+                 print(f"\r{done}/{total} cases, {failures} failures", end = "", file = sys.stderr, flush = True))
+    print("", file = sys.stderr)
+    for name, total in report["engines"].items():
+        speedup = "" if total["speedup"] == None else f"{total['speedup']:8.2f}x"
+        print(f"{name:16} {total['failures']:5} failures {total['seconds']:10.3f} s {speedup}",
+              file = sys.stderr)
+    for failure in report["failures"]:
+        print(f"FAILURE {json.dumps(failure)}", file = sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(json.dumps(report, indent = 2) + "\n")
+    return 1 if report["failures"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import OrderedDict
+
+from enigma import Enigma_machine, Enigma_stream, Rotor_spindle
+
+### Bulk encoding of many messages under a sheet of keys. The key sheet is a JSON object
+### of key names to key dictionaries (see Enigma_machine.from_key). The manifest holds one
+### JSON message per line: {"id": ..., "key": <key name>, "text": ...}, optionally with
+### its own "start_pos" (the message setting). Messages are grouped by wheel order,
+### reflector and entry wheel, so a worker process reuses the same wiring tables for a
+### whole group, and the groups are cut into tasks for a process pool. Tasks carry only
+### the positions of their lines in the manifest, and results are appended to the output
+### (JSON lines) as soon as a task finishes, so memory does not grow with the job.
+###
+
+# Compiled machines built by a worker process, by key name; reused across tasks
+_machines = OrderedDict()
+_max_machines = 256
+
+def load_key_sheet(path):
+    """Returns the key sheet dictionary stored in a JSON file, checking every key"""
+
+    with open(path) as file:
+        key_sheet = json.load(file)
+    for name, key in key_sheet.items():
+        try:
+            Enigma_machine.from_key(key)
+        except (KeyError, ValueError, TypeError) as error:
+            raise ValueError(f"Key {name}: {error}")
+    return key_sheet
+
+def _wiring_id(key):
+    """Messages with the same wiring id share the wiring tables of their rotors"""
+
+    return (key.get("model"), tuple(key["rotors"]), key.get("reflector"), key.get("reflector_pos"),
+            key.get("etw"))
+
+def plan(key_sheet, manifest, chunk_size = 256):
+    """Returns the tasks for a manifest: lists of (line number, line offset, key name),
+    grouped by wiring"""
+
+    groups = {}
+    with open(manifest, "rb") as file:
+        offset = 0
+        for number, line in enumerate(file, 1):
+            if line.strip():
+                # A line that is not a message of a known key gets a group of its own, and
+                # _encode_task reports it as an error instead of failing the whole job
+                try:
+                    message = json.loads(line)
+                    if isinstance(message, dict) == False:
+                        raise TypeError("Not a JSON object")
+                    name = message.get("key")
+                    wiring = _wiring_id(key_sheet[name])
+                except (KeyError, ValueError, TypeError):
+                    name = wiring = None
+                groups.setdefault(wiring, []).append((number, offset, name))
+            offset += len(line)
+
+    return [lines[i:i + chunk_size] for lines in groups.values()
+            for i in range(0, len(lines), chunk_size)]
+
+def _machine_for(name, key):
+    """Returns the compiled machine of a key, at its start position"""
+
+    machine = _machines.get(name)
+    if machine == None:
+        machine = Enigma_machine.from_key(key).compile()
+        _machines[name] = machine
+        if len(_machines) > _max_machines:
+            _machines.popitem(last = False)
+    else:
+        _machines.move_to_end(name)
+        machine.reset()
+    return machine
+
+def _encode_task(task):
+    """Encodes the messages at the given (line number, offset) of the manifest, returning
+    result dictionaries"""
+
+    manifest, key_sheet, lines, non_alpha = task
+    results = []
+    with open(manifest, "rb") as file:
+        for number, offset in lines:
+            file.seek(offset)
+            message = None
+            try:
+                message = json.loads(file.readline())
+                if isinstance(message, dict) == False:
+                    raise TypeError("Manifest line is not a JSON object")
+                key = key_sheet[message["key"]]
+                # A message is checked here, so a bad one is reported on its own instead of
+                # failing the task or the output
+                if isinstance(message.get("text"), str) == False:
+                    raise TypeError("text must be a string")
+                machine = _machine_for(message["key"], key)
+                if "start_pos" in message:
+                    start_pos = message["start_pos"]
+                    if (isinstance(start_pos, str) == False or len(start_pos) != len(key["rotors"])
+                            or start_pos.isascii() == False or start_pos.isalpha() == False):
+                        raise ValueError("One start letter per rotor")
+                    rings = key.get("ring_pos", [1] * len(key["rotors"]))
+                    machine.restore(Rotor_spindle.start_offsets(start_pos, rings))
+                results.append({"id": message.get("id"),
+                                "text": Enigma_stream(machine, non_alpha).encode(message["text"])})
+            except (KeyError, ValueError, TypeError) as error:
+                results.append({"line": number, "id": message.get("id") if isinstance(message, dict) else None,
+                                "error": f"{type(error).__name__}: {error}"})
+    return results
+
+def run(key_sheet, manifest, output, processes = None, chunk_size = 256, non_alpha = "pass",
+        progress = None):
+    """Encodes every message of a manifest into output (JSON lines, in order of completion).
+    Returns (messages, errors). progress(done, total) is called after every task."""
+
+    if isinstance(key_sheet, str):
+        key_sheet = load_key_sheet(key_sheet)
+    tasks = plan(key_sheet, manifest, chunk_size)
+
+    # Each task is sent only the keys it needs
+    def payload(task):
+        return (manifest, {name: key_sheet[name] for _, _, name in task if name != None},
+                [(number, offset) for number, offset, _ in task], non_alpha)
+
+    messages = 0
+    errors = 0
+    with open(output, "w") as out, multiprocessing.Pool(processes) as pool:
+        for done, results in enumerate(pool.imap_unordered(_encode_task, map(payload, tasks)), 1):
+            for result in results:
+                out.write(json.dumps(result) + "\n")
+                errors += "error" in result
+            messages += len(results)
+            out.flush()
+            if progress != None:
+                progress(done, len(tasks))
+    return messages, errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Encode a manifest of messages under a key sheet")
+    parser.add_argument("key_sheet", help = "JSON object of key names to key dictionaries")
+    parser.add_argument("manifest", help = "JSON lines: {\"id\", \"key\", \"text\", \"start_pos\"}")
+    parser.add_argument("-o", "--output", required = True, help = "JSON lines of results")
+    parser.add_argument("--processes", type = int, default = os.cpu_count())
+    parser.add_argument("--chunk-size", type = int, default = 256)
+    parser.add_argument("--non-alpha", choices = Enigma_stream._policies, default = "pass")
+    args = parser.parse_args()
+
+    try:
+        key_sheet = load_key_sheet(args.key_sheet)
+    except ValueError as error:
+        parser.error(str(error))
+
+    start = time.perf_counter()
+    messages, errors = run(key_sheet, args.manifest, args.output, args.processes, args.chunk_size,
+                           args.non_alpha, lambda done, total:
+                           print(f"\r{done}/{total} tasks", end = "", file = sys.stderr, flush = True))
+    elapsed = time.perf_counter() - start
+    print(f"\nEncoded {messages} messages ({errors} errors) in {elapsed:.2f} s", file = sys.stderr)
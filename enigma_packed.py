@@ -0,0 +1,164 @@
+import argparse
+import json
+import struct
+import sys
+import time
+
+from enigma import Compiled_machine, Enigma_machine
+
+### 5-bit packed files of letters, for archived ciphertext. A letter code 0-25 needs only
+### 5 bits, so every group of 8 letters is packed into 5 bytes (40 bits, first letter in
+### the lowest bits). Groups never share a byte, so a file is read, encoded and written a
+### whole number of groups at a time, and letter n is found in the group at byte
+### (n // 8) * 5 without reading anything before it.
+###
+### File layout: a 16 byte header (magic, number of letters) followed by the groups. The
+### last group is padded with code 0.
+###
+
+_magic = b"ENIGPK5\x00"
+_header = struct.Struct("<8sQ")
+_group = 8
+_group_bytes = 5
+_shifts = tuple(range(0, 5 * _group, 5))
+_non_letters = bytes(byte for byte in range(256) if chr(byte).isascii() == False or chr(byte).isalpha() == False)
+
+def packed_size(n_letters):
+    """Returns the number of bytes holding n_letters once packed (without the header)"""
+
+    return -(-n_letters // _group) * _group_bytes
+
+def pack(codes):
+    """Packs a buffer or sequence of codes 0-25 into bytes, 8 codes to 5 bytes"""
+
+    codes = bytes(codes)
+    if codes.translate(None, Compiled_machine._codes):
+        raise ValueError("Codes 0-25 only")
+    codes += bytes(-len(codes) % _group)
+    out = bytearray(packed_size(len(codes)))
+    position = 0
+    for i in range(0, len(codes), _group):
+        a, b, c, d, e, f, g, h = codes[i:i + _group]
+        value = a | b << 5 | c << 10 | d << 15 | e << 20 | f << 25 | g << 30 | h << 35
+        out[position:position + _group_bytes] = value.to_bytes(_group_bytes, "little")
+        position += _group_bytes
+    return bytes(out)
+
+def unpack(data, n_letters = None):
+    """Unpacks 5-bit groups (bytes-like) into a bytearray of codes 0-25; n_letters drops
+    the padding of the last group"""
+
+    data = Compiled_machine._byte_view(data)
+    if len(data) % _group_bytes:
+        raise ValueError(f"Packed data is a whole number of {_group_bytes} byte groups")
+    codes = bytearray(len(data) // _group_bytes * _group)
+    position = 0
+    for i in range(0, len(data), _group_bytes):
+        value = int.from_bytes(data[i:i + _group_bytes], "little")
+        codes[position:position + _group] = bytes(value >> shift & 31 for shift in _shifts)
+        position += _group
+    if codes.translate(None, Compiled_machine._codes):
+        raise ValueError("Packed data holds codes above 25")
+    return codes if n_letters == None else codes[:n_letters]
+
+def read_header(file):
+    """Reads the header of a packed file object, returning the number of letters"""
+
+    header = file.read(_header.size)
+    if len(header) != _header.size:
+        raise ValueError("Not a packed file: header too short")
+    magic, n_letters = _header.unpack(header)
+    if magic != _magic:
+        raise ValueError("Not a packed file")
+    return n_letters
+
+def write_header(file, n_letters):
+    file.write(_header.pack(_magic, n_letters))
+
+def write_packed(file, data, codes = False):
+    """Writes ASCII letters (or codes 0-25 with codes True) to a binary file object as a
+    packed file"""
+
+    data = Compiled_machine._byte_view(data).tobytes()
+    if codes == False:
+        data = data.translate(Compiled_machine._letters_to_code)
+        if data.translate(None, Compiled_machine._codes):
+            raise ValueError("ASCII letters only")
+    write_header(file, len(data))
+    file.write(pack(data))
+
+def read_packed(file, codes = False):
+    """Reads a whole packed file object, returning uppercase letters (or codes) as bytes"""
+
+    n_letters = read_header(file)
+    data = file.read(packed_size(n_letters))
+    if len(data) != packed_size(n_letters):
+        raise ValueError("Packed file is truncated")
+    data = bytes(unpack(data, n_letters))
+    return data if codes else data.translate(Compiled_machine._to_letter)
+
+def read_range(file, start, stop):
+    """Returns letters start to stop of a packed file object (uppercase bytes), reading
+    only the groups that hold them"""
+
+    n_letters = read_header(file)
+    start, stop = max(0, start), min(stop, n_letters)
+    if start >= stop:
+        return b""
+    first = start // _group
+    last = -(-stop // _group)
+    file.seek(_header.size + first * _group_bytes)
+    codes = unpack(file.read((last - first) * _group_bytes))
+    return bytes(codes[start - first * _group:stop - first * _group]).translate(Compiled_machine._to_letter)
+
+def encode_packed(machine, source, destination, chunk_size = 1 << 20):
+    """Encodes a packed file object into another packed file, chunk_size letters at a
+    time; only one chunk is unpacked at once. Returns the number of letters encoded."""
+
+    if isinstance(machine, Enigma_machine):
+        machine = machine.compile()
+    if isinstance(machine, Compiled_machine) == False:
+        raise TypeError("Enigma_machine or Compiled_machine instance only")
+
+    n_letters = read_header(source)
+    write_header(destination, n_letters)
+    chunk_size = max(_group, chunk_size - chunk_size % _group)
+    remaining = n_letters
+    while remaining:
+        count = min(chunk_size, remaining)
+        data = source.read(packed_size(count))
+        if len(data) != packed_size(count):
+            raise ValueError("Packed file is truncated")
+
+        # The padding of the last group is not encoded, so the rotors stop on the last letter
+        codes = unpack(data, count)
+        machine.encode_into(codes, codes, codes = True)
+        destination.write(pack(codes))
+        remaining -= count
+    return n_letters
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Pack, unpack or encode 5-bit packed letter files")
+    parser.add_argument("action", choices = ("pack", "unpack", "encode"))
+    parser.add_argument("source")
+    parser.add_argument("destination")
+    parser.add_argument("--key", help = "JSON key dictionary, for encode")
+    parser.add_argument("--chunk-size", type = int, default = 1 << 20)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with open(args.source, "rb") as source, open(args.destination, "wb") as destination:
+        if args.action == "pack":
+            letters = source.read().translate(None, _non_letters)
+            write_packed(destination, letters)
+            n_letters = len(letters)
+        elif args.action == "unpack":
+            letters = read_packed(source)
+            destination.write(letters)
+            n_letters = len(letters)
+        else:
+            if args.key == None:
+                parser.error("encode needs --key")
+            n_letters = encode_packed(Enigma_machine.from_key(json.loads(args.key)), source,
+                                      destination, args.chunk_size)
+    print(f"{args.action}: {n_letters} letters in {time.perf_counter() - start:.3f} s", file = sys.stderr)
@@ -0,0 +1,283 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+from enigma import Enigma_machine, Rotor, Rotor_spindle, Wiring_registry
+from enigma_tables import Table_cache, state_index
+
+### Known-plaintext (crib) key search. Every wheel order, reflector, ring setting and
+### start position is tried against a ciphertext / crib pair; work is spread over a
+### multiprocessing pool one (wheel order, reflector, ring setting) task at a time, and
+### finished tasks are written to a checkpoint file so long searches can be resumed.
+### With a table cache directory, workers map the substitution table of each wheel order
+### from disk (see enigma_tables.py) instead of building their own.
+###
+
+# Tables built by each worker process, shared by all tasks with the same wheel order
+_worker = {}
+
+def _init_worker(ciphertext, crib, crib_pos, plugboard, rotors, reflectors, table_cache = None):
+    """Sets up a worker process with the search parameters and the Wheels searched over"""
+
+    # Ctrl-C is handled by the parent, which stops the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Custom wheels of the parent process are not there under "spawn", so the worker
+    # builds its own frozen registry from the Wheels it was sent
+    _worker.clear()
+    _worker.update(ciphertext = ciphertext, crib = crib, crib_pos = crib_pos,
+                   plugboard = plugboard, tables = {},
+                   registry = Wiring_registry(rotors, reflectors, frozen = True),
+                   table_cache = None if table_cache == None else Table_cache(table_cache))
+
+def _search_task(task):
+    """Tries every start position for one (wheel order, reflector, ring setting)"""
+
+    order, reflector, rings = task
+    key = {"rotors": list(order), "ring_pos": list(rings), "reflector": reflector,
+           "plugboard": _worker["plugboard"]}
+    registry = _worker["registry"]
+    stepper = Enigma_machine.from_key(key, registry = registry)._rotorspindle.stepper()
+    if _worker["table_cache"] != None and len(order) <= Table_cache._max_rotors:
+        return _search_task_table(task, key, stepper)
+
+    # The wiring tables do not depend on the ring setting, so they are reused
+    if (order, reflector) not in _worker["tables"]:
+        _worker["tables"][(order, reflector)] = (Enigma_machine.from_key(key, registry = registry).compile(), {})
+    compiled, inners = _worker["tables"][(order, reflector)]
+
+    def inner_for(rest):
+        if rest not in inners:
+            inners[rest] = compiled._compose_inner((0,) + rest)
+        return inners[rest]
+
+    entry = compiled._entry
+    exit_ = compiled._exit
+    engage = stepper._engage[0]
+    pairs = list(zip(_worker["ciphertext"], _worker["crib"]))
+    crib_pos = _worker["crib_pos"]
+
+    found = []
+    for start in itertools.product(range(26), repeat = len(order)):
+        state = stepper.advance(start, crib_pos) if crib_pos else start
+        offset = state[0]
+        rest = state[1:]
+        inner = inner_for(rest)
+        slow_engaged = stepper._slow_engaged(state)
+
+        for cipher_code, crib_code in pairs:
+            if slow_engaged or engage[offset]:
+                state = stepper.step((offset,) + rest)
+                offset = state[0]
+                rest = state[1:]
+                inner = inner_for(rest)
+                slow_engaged = stepper._slow_engaged(state)
+            else:
+                offset = offset + 1 if offset != 25 else 0
+            if exit_[offset][inner[entry[offset][cipher_code]]] != crib_code:
+                break
+        else:
+            found.append(dict(key, start_pos = Rotor_spindle.start_letters(start, rings)))
+
+    return Key_search._task_id(task), found
+
+def _search_task_table(task, key, stepper):
+    """Tries every start position for one task using the mapped substitution table"""
+
+    order, reflector, rings = task
+    table = _worker["table_cache"].table(Enigma_machine.from_key(dict(key, plugboard = []),
+                                                                 registry = _worker["registry"]))
+
+    # The table has no plugboard; as the plugboard swaps letters in pairs, plug[table[plug[c]]]
+    # equals the crib letter exactly when table[plug[c]] equals plug[crib letter]
+    plug = list(range(26))
+    for pair in _worker["plugboard"]:
+        a, b = ord(pair[0].upper()) - 65, ord(pair[1].upper()) - 65
+        plug[a], plug[b] = b, a
+    pairs = [(plug[cipher_code], plug[crib_code])
+             for cipher_code, crib_code in zip(_worker["ciphertext"], _worker["crib"])]
+    engage = stepper._engage[0]
+    crib_pos = _worker["crib_pos"]
+
+    found = []
+    for start in itertools.product(range(26), repeat = len(order)):
+        state = stepper.advance(start, crib_pos) if crib_pos else start
+        offset = state[0]
+        row = state_index(state) * 26
+        slow_engaged = stepper._slow_engaged(state)
+
+        for cipher_code, crib_code in pairs:
+            if slow_engaged or engage[offset]:
+                state = stepper.step((offset,) + state[1:])
+                offset = state[0]
+                row = state_index(state) * 26
+                slow_engaged = stepper._slow_engaged(state)
+            elif offset != 25:
+                offset += 1
+                row += 26
+            else:
+                offset = 0
+                row -= 650
+            if table[row + cipher_code] != crib_code:
+                break
+        else:
+            found.append(dict(key, start_pos = Rotor_spindle.start_letters(start, rings)))
+
+    return Key_search._task_id(task), found
+
+class Key_search():
+    """Creates Key_search object which finds the keys consistent with a ciphertext and crib"""
+
+    def __init__(self, ciphertext, crib, crib_pos = 0, rotors = ("I", "II", "III", "IV", "V"),
+                 reflectors = ("B",), n_rotors = 3, ring_settings = None, plugboard = (),
+                 processes = None, checkpoint = None, checkpoint_every = 30, registry = None,
+                 table_cache = None):
+
+        for text in (ciphertext, crib):
+            if isinstance(text, str) == False or text.isascii() == False or text.isalpha() == False:
+                raise ValueError("Ciphertext and crib must be letters A-Z")
+        if crib_pos < 0 or crib_pos + len(crib) > len(ciphertext):
+            raise ValueError("Crib must lie within the ciphertext")
+        registry = Rotor._registry if registry == None else registry
+        for name in rotors:
+            if name not in registry.rotor_names():
+                raise ValueError(f"Unknown rotor {name}")
+        for name in reflectors:
+            if name not in registry.reflector_names():
+                raise ValueError(f"Unknown reflector {name}")
+
+        self._ciphertext = ciphertext.upper()
+        self._crib = crib.upper()
+        self._crib_pos = crib_pos
+        self._rotors = list(rotors)
+        self._reflectors = list(reflectors)
+        self._registry = registry
+        self._n_rotors = n_rotors
+        self._plugboard = list(plugboard)
+        self._processes = processes
+        self._checkpoint = checkpoint
+        self._checkpoint_every = checkpoint_every
+        self._table_cache = table_cache
+        self._cancel = threading.Event()
+
+        # Only the rings of the two right hand rotors change the stepping. Any other ring
+        # setting is the same as a different start position, so those rings are left at 1.
+        if ring_settings == None:
+            ring_settings = itertools.product(*([[1]] * (n_rotors - 2)
+                                                + [range(1, 27)] * min(n_rotors, 2)))
+        self._ring_settings = [tuple(rings) for rings in ring_settings]
+
+    @staticmethod
+    def _task_id(task):
+        order, reflector, rings = task
+        return f"{'-'.join(order)}/{reflector}/{'-'.join(str(i) for i in rings)}"
+
+    def tasks(self):
+        """Returns the list of (wheel order, reflector, ring setting) tasks"""
+
+        return [(order, reflector, rings)
+                for order in itertools.permutations(self._rotors, self._n_rotors)
+                for reflector in self._reflectors
+                for rings in self._ring_settings]
+
+    def _parameters(self):
+        return {"ciphertext": self._ciphertext, "crib": self._crib, "crib_pos": self._crib_pos,
+                "plugboard": self._plugboard}
+
+    def _load_checkpoint(self):
+        """Returns the finished task ids and candidates stored in the checkpoint file"""
+
+        if self._checkpoint == None or os.path.exists(self._checkpoint) == False:
+            return set(), []
+        with open(self._checkpoint) as file:
+            state = json.load(file)
+        if state["parameters"] != self._parameters():
+            raise ValueError("Checkpoint belongs to a different search")
+        return set(state["done"]), state["candidates"]
+
+    def _save_checkpoint(self, done, candidates):
+        if self._checkpoint == None:
+            return
+        temporary = self._checkpoint + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump({"parameters": self._parameters(), "done": sorted(done),
+                       "candidates": candidates}, file)
+        os.replace(temporary, self._checkpoint)
+
+    def cancel(self):
+        """Stops a running search after the current task; the checkpoint is kept"""
+
+        self._cancel.set()
+
+    def run(self, progress = None):
+        """Runs the search, returning a list of candidate key dictionaries.
+
+        progress(done, total, candidates) is called after every finished task. Ctrl-C stops
+        the search like cancel(), returning the candidates found so far.
+        """
+
+        self._cancel.clear()
+        done, candidates = self._load_checkpoint()
+        tasks = self.tasks()
+        pending = [task for task in tasks if self._task_id(task) not in done]
+
+        # Task payloads name the rotors; workers get the Wheels for those names here
+        initargs = (self._codes(self._ciphertext[self._crib_pos:self._crib_pos + len(self._crib)]),
+                    self._codes(self._crib), self._crib_pos, self._plugboard,
+                    [self._registry.rotor(name) for name in self._rotors],
+                    [self._registry.reflector(name) for name in self._reflectors],
+                    self._table_cache)
+
+        # The finished tasks are saved however the loop ends, so the search can resume
+        saved = time.monotonic()
+        try:
+            with multiprocessing.Pool(self._processes, _init_worker, initargs) as pool:
+                for task_id, found in pool.imap_unordered(_search_task, pending):
+                    done.add(task_id)
+                    candidates.extend(found)
+                    if progress != None:
+                        progress(len(done), len(tasks), candidates)
+                    if self._cancel.is_set():
+                        break
+                    if time.monotonic() - saved > self._checkpoint_every:
+                        self._save_checkpoint(done, candidates)
+                        saved = time.monotonic()
+        except KeyboardInterrupt:
+            self._cancel.set()
+        finally:
+            self._save_checkpoint(done, candidates)
+        return candidates
+
+    @staticmethod
+    def _codes(text):
+        return [ord(letter) - 65 for letter in text]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Known-plaintext Enigma key search")
+    parser.add_argument("ciphertext")
+    parser.add_argument("crib")
+    parser.add_argument("--crib-pos", type = int, default = 0)
+    parser.add_argument("--rotors", nargs = "+", default = ["I", "II", "III", "IV", "V"])
+    parser.add_argument("--reflectors", nargs = "+", default = ["B"])
+    parser.add_argument("--plugboard", nargs = "*", default = [])
+    parser.add_argument("--processes", type = int)
+    parser.add_argument("--checkpoint")
+    parser.add_argument("--table-cache", help = "directory of memory-mapped substitution tables")
+    args = parser.parse_args()
+
+    search = Key_search(args.ciphertext, args.crib, args.crib_pos, args.rotors, args.reflectors,
+                        plugboard = args.plugboard, processes = args.processes,
+                        checkpoint = args.checkpoint, table_cache = args.table_cache)
+
+    def report(done, total, candidates):
+        print(f"\r{done}/{total} tasks, {len(candidates)} candidates", end = "", flush = True)
+
+    found = search.run(report)
+    print("")
+    for key in found:
+        print(json.dumps(key))
@@ -0,0 +1,242 @@
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import json
+import random
+import statistics
+import threading
+import time
+from collections import OrderedDict
+
+from enigma import Enigma_machine
+
+### asyncio encoding service. Compiled machines are kept in a pool per key and moved back
+### to their start position when reused, instead of being rebuilt for every request.
+### Short messages are encoded on the event loop; long ones are sent to a process pool so
+### they do not block it. The number of requests being encoded, and waiting, is bounded.
+### Requests and responses are JSON lines over TCP; load_test() drives a server with many
+### connections and reports the latency percentiles.
+###
+
+class Service_busy(RuntimeError):
+    """Raised when the service already has as many requests waiting as it allows"""
+
+class Machine_pool():
+    """Creates Machine_pool object, idle compiled machines kept per key"""
+
+    def __init__(self, max_idle = 8, max_keys = 1024):
+
+        self.max_idle = max_idle
+        self.max_keys = max_keys
+        self.built = 0
+        self.reused = 0
+        self._idle = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_id(key):
+        """Returns a string naming a key dictionary, the same for equal dictionaries"""
+
+        return json.dumps(key, sort_keys = True)
+
+    @contextlib.contextmanager
+    def machine(self, key):
+        """Context manager lending a Compiled_machine for key, at the key's start position"""
+
+        key_id = Machine_pool.key_id(key)
+        with self._lock:
+            machines = self._idle.get(key_id)
+            machine = machines.pop() if machines else None
+            if machine != None:
+                self.reused += 1
+
+        if machine == None:
+            machine = Enigma_machine.from_key(key).compile()
+            with self._lock:
+                self.built += 1
+        else:
+            # Move the rotors back to the start; the wiring tables are kept
+            machine.reset()
+
+        try:
+            yield machine
+        finally:
+            with self._lock:
+                machines = self._idle.setdefault(key_id, [])
+                self._idle.move_to_end(key_id)
+                if len(machines) < self.max_idle:
+                    machines.append(machine)
+                while len(self._idle) > self.max_keys:
+                    self._idle.popitem(last = False)
+
+    def info(self):
+        """Returns a dictionary of the pool counters"""
+
+        with self._lock:
+            return {"built": self.built, "reused": self.reused, "keys": len(self._idle),
+                    "idle": sum(len(machines) for machines in self._idle.values())}
+
+# Pool of the worker processes, used by _encode_job
+_process_pool = Machine_pool()
+
+def _encode_job(key, text):
+    """Encodes text under key in a worker process"""
+
+    with _process_pool.machine(key) as machine:
+        return machine.encode(text)
+
+class Encoding_service():
+    """Creates Encoding_service object, which encodes requests from asyncio code"""
+
+    def __init__(self, max_concurrent = 64, max_waiting = 1024, offload_length = 4096,
+                 processes = None, pool = None):
+
+        self.offload_length = offload_length
+        self.max_waiting = max_waiting
+        self.pool = Machine_pool() if pool == None else pool
+        self.completed = 0
+        self.rejected = 0
+        self._processes = processes
+        self._executor = None
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._waiting = 0
+
+    def _offload(self):
+        if self._executor == None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(self._processes)
+        return self._executor
+
+    async def encode(self, key, text):
+        """Encodes text from the start position of key, returning the encoded string.
+        Raises Service_busy when max_waiting requests are already queued."""
+
+        if self._waiting >= self.max_waiting:
+            self.rejected += 1
+            raise Service_busy("Too many requests waiting")
+
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+        try:
+            if len(text) >= self.offload_length:
+                loop = asyncio.get_running_loop()
+                encoded = await loop.run_in_executor(self._offload(), _encode_job, key, text)
+            else:
+                with self.pool.machine(key) as machine:
+                    encoded = machine.encode(text)
+        finally:
+            self._semaphore.release()
+        self.completed += 1
+        return encoded
+
+    async def handle(self, reader, writer):
+        """Serves one connection: a JSON request {"key": ..., "text": ...} per line, answered
+        with {"text": ...} or {"error": ...}"""
+
+        try:
+            while True:
+                line = await reader.readline()
+                if line == b"":
+                    break
+                try:
+                    request = json.loads(line)
+                    response = {"text": await self.encode(request["key"], request["text"])}
+                except Service_busy as error:
+                    response = {"error": str(error), "busy": True}
+                except (ValueError, KeyError, TypeError) as error:
+                    response = {"error": f"{type(error).__name__}: {error}"}
+                writer.write(json.dumps(response).encode("ascii") + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host = "127.0.0.1", port = 8765):
+        """Runs the service until cancelled"""
+
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def info(self):
+        return dict(self.pool.info(), completed = self.completed, rejected = self.rejected,
+                    waiting = self._waiting)
+
+    def close(self):
+        if self._executor != None:
+            self._executor.shutdown()
+            self._executor = None
+
+async def load_test(host = "127.0.0.1", port = 8765, requests = 1000, connections = 16, length = 100,
+                    keys = 4, seed = 0):
+    """Sends requests over several connections, returning a dictionary of latency
+    percentiles (seconds), throughput and errors"""
+
+    rng = random.Random(seed)
+    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    rotors = ["I", "II", "III", "IV", "V"]
+    key_list = [{"rotors": rng.sample(rotors, 3), "reflector": "B",
+                 "start_pos": "".join(rng.choices(alphabet, k = 3)),
+                 "ring_pos": [rng.randint(1, 26) for _ in range(3)],
+                 "plugboard": ["AB", "CD", "EF"]} for _ in range(keys)]
+    latencies = []
+    errors = []
+
+    async def client(n):
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for _ in range(n):
+                request = {"key": rng.choice(key_list), "text": "".join(rng.choices(alphabet, k = length))}
+                start = time.perf_counter()
+                writer.write(json.dumps(request).encode("ascii") + b"\n")
+                await writer.drain()
+                response = json.loads(await reader.readline())
+                latencies.append(time.perf_counter() - start)
+                if "error" in response:
+                    errors.append(response["error"])
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(requests // connections + (i < requests % connections))
+                           for i in range(connections)])
+    elapsed = time.perf_counter() - start
+
+    percentiles = statistics.quantiles(latencies, n = 100) if len(latencies) > 1 else latencies * 99
+    return {"requests": len(latencies), "errors": len(errors), "seconds": elapsed,
+            "requests_per_second": len(latencies) / elapsed,
+            "p50": percentiles[49], "p99": percentiles[98], "max": max(latencies)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Enigma encoding service")
+    parser.add_argument("command", choices = ["serve", "load"])
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8765)
+    parser.add_argument("--max-concurrent", type = int, default = 64)
+    parser.add_argument("--max-waiting", type = int, default = 1024)
+    parser.add_argument("--offload-length", type = int, default = 4096)
+    parser.add_argument("--processes", type = int)
+    parser.add_argument("--requests", type = int, default = 1000)
+    parser.add_argument("--connections", type = int, default = 16)
+    parser.add_argument("--length", type = int, default = 100)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        service = Encoding_service(args.max_concurrent, args.max_waiting, args.offload_length,
+                                   args.processes)
+        try:
+            asyncio.run(service.serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            service.close()
+    else:
+        result = asyncio.run(load_test(args.host, args.port, args.requests, args.connections,
+                                       args.length))
+        print(f"{result['requests']} requests, {result['errors']} errors, " +
+              f"{result['requests_per_second']:.0f} requests/s, " +
+              f"p50 {result['p50'] * 1000:.2f} ms, p99 {result['p99'] * 1000:.2f} ms, " +
+              f"max {result['max'] * 1000:.2f} ms")
@@ -0,0 +1,287 @@
+import argparse
+import heapq
+import itertools
+import math
+import random
+import time
+from array import array
+
+from enigma import Enigma_machine, Plugboard, Rotor
+
+### Ciphertext-only attack. Rotor settings are ranked by the index of coincidence of
+### their decrypt without a plugboard, the ring settings of the two right hand rotors
+### are refined the same way, and the plugboard leads are then found by hill-climbing.
+### The hill-climb decrypts the same ciphertext under the same rotor settings over and
+### over, so the substitution at every position is computed once (Fast_decryptor) and
+### only the plugboard permutation changes between decrypts.
+###
+
+def index_of_coincidence(codes):
+    """Returns the index of coincidence of bytes of letter codes 0-25"""
+
+    if len(codes) < 2:
+        return 0.0
+    total = sum(count * (count - 1) for count in (codes.count(code) for code in range(26)))
+    return total / (len(codes) * (len(codes) - 1))
+
+class Ngram_table():
+    """Creates Ngram_table object, n-gram log-probabilities held in a flat array"""
+
+    def __init__(self, n, log_probs):
+
+        if len(log_probs) != 26 ** n:
+            raise ValueError(f"{26 ** n} log-probabilities required")
+        self.n = n
+        self._table = array("d", log_probs)
+
+    @classmethod
+    def from_text(cls, text, n):
+        """Counts the n-grams in a corpus of text; unseen n-grams get a floor value"""
+
+        codes = [ord(letter) - 65 for letter in text.upper() if "A" <= letter <= "Z"]
+        counts = [0] * 26 ** n
+        for i in range(len(codes) - n + 1):
+            idx = 0
+            for code in codes[i:i + n]:
+                idx = idx * 26 + code
+            counts[idx] += 1
+
+        total = sum(counts)
+        if total == 0:
+            raise ValueError("Corpus contains no n-grams")
+        floor = math.log10(0.01 / total)
+        return cls(n, [math.log10(count / total) if count else floor for count in counts])
+
+    @classmethod
+    def from_file(cls, path, n):
+        with open(path) as file:
+            return cls.from_text(file.read(), n)
+
+    def score(self, codes):
+        """Returns the summed log-probability of the n-grams in bytes of letter codes"""
+
+        table = self._table
+        if self.n == 1:
+            return sum(table[a] for a in codes)
+        if self.n == 2:
+            return sum(table[a * 26 + b] for a, b in zip(codes, codes[1:]))
+        if self.n == 3:
+            return sum(table[(a * 26 + b) * 26 + c] for a, b, c in zip(codes, codes[1:], codes[2:]))
+
+        size = 26 ** (self.n - 1)
+        idx = 0
+        score = 0.0
+        for i, code in enumerate(codes):
+            idx = (idx % size) * 26 + code
+            if i >= self.n - 1:
+                score += table[idx]
+        return score
+
+class Fast_decryptor():
+    """Creates Fast_decryptor object which decrypts one ciphertext under fixed rotor
+    settings with any plugboard"""
+
+    def __init__(self, ciphertext, key):
+
+        compiled = Enigma_machine.from_key(dict(key, plugboard = [])).compile()
+        self._permutations = compiled.permutations(len(ciphertext))
+        self._codes = bytes(ord(letter) - 65 for letter in ciphertext.upper())
+
+    def decrypt(self, plug):
+        """Returns the decrypt as bytes of codes; plug is a list of 26 codes in which
+        connected letters map to each other"""
+
+        return bytes([plug[permutation[plug[code]]]
+                      for permutation, code in zip(self._permutations, self._codes)])
+
+class Ciphertext_solver():
+    """Creates Ciphertext_solver object which searches for the key of a ciphertext alone"""
+
+    def __init__(self, ciphertext, rotors = ("I", "II", "III", "IV", "V"), reflectors = ("B",),
+                 n_rotors = 3, tables = (), max_leads = 10):
+
+        if isinstance(ciphertext, str) == False or ciphertext.isascii() == False or ciphertext.isalpha() == False:
+            raise ValueError("Ciphertext must be letters A-Z")
+
+        self._ciphertext = ciphertext.upper()
+        self._codes = bytes(ord(letter) - 65 for letter in self._ciphertext)
+        self._rotors = list(rotors)
+        self._reflectors = list(reflectors)
+        self._n_rotors = n_rotors
+        self._tables = sorted(tables, key = lambda table: table.n)
+        self._max_leads = max_leads
+
+    def _decrypt_ioc(self, key):
+        """Returns the index of coincidence of the decrypt without a plugboard"""
+
+        compiled = Enigma_machine.from_key(dict(key, plugboard = [])).compile()
+        out = bytearray(len(self._codes))
+        compiled._encode_codes(self._codes, out)
+        return index_of_coincidence(out)
+
+    def rank_rotor_settings(self, top = 10, orders = None, progress = None):
+        """Returns the best (index of coincidence, key) pairs over wheel orders, reflectors
+        and start positions, with all rings at 1"""
+
+        if orders == None:
+            orders = list(itertools.permutations(self._rotors, self._n_rotors))
+        codes = self._codes
+        best = []
+
+        for done, (order, reflector) in enumerate(itertools.product(orders, self._reflectors)):
+            key = {"rotors": list(order), "reflector": reflector}
+            compiled = Enigma_machine.from_key(key).compile()
+            stepper = compiled._stepper
+            entry = compiled._entry
+            exit_ = compiled._exit
+            inners = {}
+
+            # With rings at 1 the offsets are the start positions themselves
+            for start in itertools.product(range(26), repeat = len(order)):
+                out = bytearray(len(codes))
+                idx = 0
+                for first, count in stepper.runs(start, len(codes)):
+                    rest = first[1:]
+                    if rest not in inners:
+                        inners[rest] = compiled._compose_inner(first)
+                    inner = inners[rest]
+                    offset = first[0]
+                    for code in codes[idx:idx + count]:
+                        out[idx] = exit_[offset][inner[entry[offset][code]]]
+                        idx += 1
+                        offset = offset + 1 if offset != 25 else 0
+
+                score = index_of_coincidence(out)
+                if len(best) < top or score > best[0][0]:
+                    start_pos = "".join(Rotor._alphabet[o] for o in start[::-1])
+                    entry_key = (score, tuple(order), reflector, start_pos)
+                    if len(best) < top:
+                        heapq.heappush(best, entry_key)
+                    else:
+                        heapq.heapreplace(best, entry_key)
+
+            if progress != None:
+                progress(done + 1, len(orders) * len(self._reflectors))
+
+        return [(score, {"rotors": list(order), "reflector": reflector, "start_pos": start_pos,
+                         "ring_pos": [1] * len(order)})
+                for score, order, reflector, start_pos in sorted(best, reverse = True)]
+
+    def refine_rings(self, key):
+        """Returns (index of coincidence, key) for the best rings of the two right hand
+        rotors, keeping the rotor offsets at the start of the message unchanged"""
+
+        best = (self._decrypt_ioc(key), key)
+        n = len(key["rotors"])
+        for right, middle in itertools.product(range(1, 27), repeat = 2):
+            rings = list(key["ring_pos"])
+            start_pos = list(key["start_pos"])
+            for i, ring in ((n - 1, right), (n - 2, middle)):
+                if i >= 0:
+                    offset = (ord(start_pos[i]) - 64 - rings[i]) % 26
+                    rings[i] = ring
+                    start_pos[i] = Rotor._alphabet[(offset + ring - 1) % 26]
+            trial = dict(key, ring_pos = rings, start_pos = "".join(start_pos))
+            score = self._decrypt_ioc(trial)
+            if score > best[0]:
+                best = (score, trial)
+        return best
+
+    def climb_plugboard(self, key, score = None):
+        """Hill-climbs the plugboard leads for fixed rotor settings. Returns (score, key)."""
+
+        decryptor = Fast_decryptor(self._ciphertext, key)
+        score = index_of_coincidence if score == None else score
+        plugboard = Plugboard()
+        for pair in key.get("plugboard") or []:
+            plugboard.swap(pair[0], pair[1])
+        best = score(decryptor.decrypt(plugboard.permutation))
+
+        improved = True
+        while improved:
+            improved = False
+            for a, b in itertools.combinations(range(26), 2):
+                # Connect a and b, freeing their current partners; or disconnect them. A
+                # trial that doesn't score better is undone.
+                checkpoint = plugboard.checkpoint()
+                if plugboard.partner(a) == b:
+                    plugboard.unswap(a)
+                else:
+                    plugboard.swap(a, b)
+                    if len(plugboard.leads()) > self._max_leads:
+                        plugboard.undo(checkpoint)
+                        continue
+                trial_score = score(decryptor.decrypt(plugboard.permutation))
+                if trial_score > best:
+                    best, improved = trial_score, True
+                    plugboard.commit()
+                else:
+                    plugboard.undo(checkpoint)
+
+        return best, dict(key, plugboard = plugboard.leads())
+
+    def solve(self, top = 5, orders = None, progress = None):
+        """Runs the whole attack. Returns (score, key, plaintext) for the best key found."""
+
+        best = None
+        for _, key in self.rank_rotor_settings(top, orders, progress):
+            _, key = self.refine_rings(key)
+            score, key = self.climb_plugboard(key)
+            for table in self._tables:
+                score, key = self.climb_plugboard(key, table.score)
+            if best == None or score > best[0]:
+                best = (score, key)
+
+        score, key = best
+        return score, key, Enigma_machine.from_key(key).encode(self._ciphertext)
+
+def benchmark(length = 250, seconds = 2.0):
+    """Returns decrypts per second of the Fast_decryptor and of Enigma_machine.encode"""
+
+    key = {"rotors": ["I", "II", "III"], "start_pos": "AAZ", "reflector": "B",
+           "plugboard": ["HL", "MO", "AJ", "CX", "BZ", "SR", "NI", "YW", "DG", "PK"]}
+    ciphertext = "".join(random.choice(Rotor._alphabet) for _ in range(length))
+
+    decryptor = Fast_decryptor(ciphertext, key)
+    plug = list(range(26))
+    for pair in key["plugboard"]:
+        a, b = ord(pair[0]) - 65, ord(pair[1]) - 65
+        plug[a], plug[b] = b, a
+
+    rates = {}
+    for name, decrypt in (("fast", lambda: decryptor.decrypt(plug)),
+                          ("reference", lambda: Enigma_machine.from_key(key).encode(ciphertext))):
+        count = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds / 2:
+            decrypt()
+            count += 1
+        rates[name] = count / (time.perf_counter() - start)
+    return rates
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Ciphertext-only Enigma solver")
+    parser.add_argument("ciphertext", nargs = "?")
+    parser.add_argument("--rotors", nargs = "+", default = ["I", "II", "III", "IV", "V"])
+    parser.add_argument("--reflectors", nargs = "+", default = ["B"])
+    parser.add_argument("--corpus", help = "text used to build bigram and trigram tables")
+    parser.add_argument("--top", type = int, default = 5)
+    parser.add_argument("--benchmark", action = "store_true")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        rates = benchmark()
+        print(f"Fast_decryptor: {rates['fast']:.0f} decrypts/s, " +
+              f"Enigma_machine: {rates['reference']:.0f} decrypts/s, " +
+              f"Speedup: {rates['fast'] / rates['reference']:.1f}x")
+    elif args.ciphertext:
+        tables = ([Ngram_table.from_file(args.corpus, n) for n in (2, 3)]
+                  if args.corpus else [])
+        solver = Ciphertext_solver(args.ciphertext, args.rotors, args.reflectors, tables = tables)
+        score, key, plaintext = solver.solve(args.top, progress = lambda done, total:
+                                             print(f"\r{done}/{total} wheel orders", end = "", flush = True))
+        print("")
+        print(key)
+        print(plaintext)
+    else:
+        parser.print_help()
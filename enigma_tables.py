@@ -0,0 +1,228 @@
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import time
+
+from enigma import Compiled_machine, Enigma_machine
+
+### On-disk cache of substitution tables. For a wheel order, reflector and entry wheel the
+### table holds the substitution (without plugboard) at every combination of rotor offsets:
+### 26 ** n_rotors rows of 26 bytes, row index = offsets right to left as base 26 digits
+### (right hand rotor lowest). Offsets already take the ring settings into account, and
+### the notches only decide which row comes next, so one table serves every ring setting
+### and notch. Files are written once, atomically, and opened with mmap, so processes
+### share the same pages of the page cache instead of each building their own copy.
+###
+### File layout: a 128 byte header (magic, version, number of rotors, key digest, SHA-256
+### of the table, table length) followed by the table.
+###
+
+_magic = b"ENIGTBL\x00"
+_version = 1
+_header = struct.Struct("<8sHH32s32sQ")
+_header_size = 128
+_suffix = ".tbl"
+
+def table_key(rotorspindle, reflector, etw = None):
+    """Returns the hex digest naming the table of a rotor spindle, reflector and entry wheel"""
+
+    # A moving reflector is one more wheel of the rotor positions, after the rotors
+    wheels = rotorspindle.wheels()
+    digest = hashlib.sha256(struct.pack("<HH", _version, len(wheels)))
+    for _rotor in wheels:
+        digest.update(bytes(_rotor._wiring))
+    digest.update(b"|" + bytes(reflector._wiring))
+    digest.update(b"|" + (b"" if etw == None else etw.encode("ascii")))
+    return digest.hexdigest()
+
+def state_index(offsets):
+    """Returns the row of the table for rotor offsets (right to left)"""
+
+    index = 0
+    for offset in reversed(offsets):
+        index = index * 26 + offset
+    return index
+
+def build_table(rotorspindle, reflector, etw = None):
+    """Returns the substitution table (bytes) of a rotor spindle, reflector and entry wheel"""
+
+    compiled = Compiled_machine(rotorspindle, reflector, None, etw)
+    n_rotors = len(compiled.offsets())
+    entry = compiled._entry
+    exit_ = compiled._exit
+    table = bytearray(26 ** n_rotors * 26)
+    position = 0
+    for slow in range(26 ** (n_rotors - 1)):
+        rest = tuple(slow // 26 ** i % 26 for i in range(n_rotors - 1))
+        inner = compiled._compose_inner((0,) + rest)
+        for offset in range(26):
+            entry_offset = entry[offset]
+            exit_offset = exit_[offset]
+            table[position:position + 26] = bytes(exit_offset[inner[entry_offset[code]]]
+                                                  for code in range(26))
+            position += 26
+    return bytes(table)
+
+class Table_cache():
+    """Creates Table_cache object, a directory of memory-mapped substitution tables"""
+
+    # A table has 26 ** (n_rotors + 1) bytes: 12 MB for 4 rotors, 309 MB for 5
+    _max_rotors = 4
+
+    def __init__(self, directory, max_bytes = 1 << 30, verify = True):
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.verify = verify
+        self.hits = 0
+        self.built = 0
+        self.rejected = 0
+        self.evicted = 0
+        self._open = {}
+        os.makedirs(directory, exist_ok = True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + _suffix)
+
+    def _load(self, key, n_rotors):
+        """Returns a memoryview of the table in the file of key, or None if there is no
+        usable file; a damaged file is removed"""
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file:
+                data = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        length = 26 ** n_rotors * 26
+        valid = len(data) == _header_size + length
+        if valid:
+            magic, version, rotors, key_digest, table_digest, table_length = _header.unpack_from(data)
+            valid = (magic == _magic and version == _version and rotors == n_rotors
+                     and key_digest.hex() == key and table_length == length)
+        if valid and self.verify:
+            valid = hashlib.sha256(memoryview(data)[_header_size:]).digest() == table_digest
+        if valid == False:
+            data.close()
+            self.rejected += 1
+            # On Windows a file still mapped by another process can't be removed; it is
+            # left for that process and built again here
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        # Newest modification time is the most recently used, for eviction
+        os.utime(path)
+        return memoryview(data)[_header_size:]
+
+    def _store(self, key, n_rotors, table):
+        """Writes a table to the file of key; the rename makes the file appear complete"""
+
+        header = _header.pack(_magic, _version, n_rotors, bytes.fromhex(key),
+                              hashlib.sha256(table).digest(), len(table))
+        temporary = f"{self._path(key)}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            file.write(header.ljust(_header_size, b"\x00"))
+            file.write(table)
+        os.replace(temporary, self._path(key))
+        self.evict(keep = key)
+
+    def table(self, machine):
+        """Returns the table of an Enigma_machine (read-only memoryview), built and stored
+        the first time it is asked for. Index it with state_index(offsets) * 26 + code."""
+
+        if isinstance(machine, Enigma_machine) == False:
+            raise TypeError("Enigma_machine instance only")
+        rotorspindle, reflector, etw = machine._rotorspindle, machine._reflector, machine._etw
+        key = table_key(rotorspindle, reflector, etw)
+        if key in self._open:
+            self.hits += 1
+            return self._open[key]
+
+        n_rotors = len(rotorspindle.wheels())
+        if n_rotors > Table_cache._max_rotors:
+            raise ValueError(f"Tables are kept for at most {Table_cache._max_rotors} rotors")
+        table = self._load(key, n_rotors)
+        if table == None:
+            self._store(key, n_rotors, build_table(rotorspindle, reflector, etw))
+            self.built += 1
+            table = self._load(key, n_rotors)
+            if table == None:
+                raise OSError(f"Table {key} could not be read back")
+        else:
+            self.hits += 1
+        self._open[key] = table
+        return table
+
+    def files(self):
+        """Returns (path, size, last used) for every table file, least recently used first"""
+
+        found = []
+        for name in os.listdir(self.directory):
+            if name.endswith(_suffix):
+                path = os.path.join(self.directory, name)
+                try:
+                    status = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((path, status.st_size, status.st_mtime))
+        return sorted(found, key = lambda item: item[2])
+
+    def evict(self, keep = None):
+        """Removes the least recently used table files until the cache fits in max_bytes"""
+
+        files = self.files()
+        total = sum(size for _, size, _ in files)
+        for path, size, _ in files:
+            if total <= self.max_bytes:
+                break
+            if keep != None and path == self._path(keep):
+                continue
+            try:
+                os.remove(path)
+                self.evicted += 1
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # Still mapped by another process (Windows): skipped, and its size still counts
+                continue
+            total -= size
+
+    def info(self):
+        """Returns a dictionary of the cache counters and size on disk"""
+
+        files = self.files()
+        return {"hits": self.hits, "built": self.built, "rejected": self.rejected,
+                "evicted": self.evicted, "files": len(files),
+                "bytes": sum(size for _, size, _ in files)}
+
+    def close(self):
+        """Releases the tables opened by this object; memoryviews still in use keep theirs"""
+
+        self._open.clear()
+
+    def __str__(self):
+        info = self.info()
+        return (f"Table cache {self.directory}: {info['files']} tables, {info['bytes']} bytes")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Build or inspect the substitution table cache")
+    parser.add_argument("directory")
+    parser.add_argument("--rotors", nargs = "+", help = "wheel order to build, left to right")
+    parser.add_argument("--reflector", default = "B")
+    parser.add_argument("--max-bytes", type = int, default = 1 << 30)
+    args = parser.parse_args()
+
+    cache = Table_cache(args.directory, args.max_bytes)
+    if args.rotors:
+        start = time.perf_counter()
+        cache.table(Enigma_machine.from_key({"rotors": args.rotors, "reflector": args.reflector}))
+        action = "built" if cache.built else "loaded"
+        print(f"Table {action} in {time.perf_counter() - start:.3f} s", file = sys.stderr)
+    print(cache)